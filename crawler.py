@@ -1,141 +1,24 @@
 import tkinter as tk
 from tkinter import messagebox
 import sqlite3
-import re
-from googleapiclient.discovery import build
+import queue
+import threading
+import time
+from collections import deque
 from googleapiclient.errors import HttpError
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-import os
 import ttkbootstrap as ttkb
 from ttkbootstrap.tableview import Tableview  # Correct import
-from google.auth.transport.requests import Request
-
-# Google Drive API Setup
-SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
-
-def authenticate():
-    """Authenticate with Google APIs."""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json')
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return creds
-
-# SQLite Database Setup
-def init_db():
-    """Initialize SQLite database in the same directory as the script."""
-    db_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "documents.db")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS documents (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT,
-                        doc_index TEXT,    -- Renamed from 'index' to 'doc_index'
-                        folder TEXT,
-                        url TEXT)''')
-    conn.commit()
-    conn.close()
-
-def insert_into_db(name, index, folder, url):
-    """Insert document info into SQLite database."""
-    db_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "documents.db")
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO documents (name, doc_index, folder, url) VALUES (?, ?, ?, ?)", 
-                       (name, index, folder, url))
-        conn.commit()
-        conn.close()
-    except sqlite3.Error as e:
-        messagebox.showerror("Database Error", f"An error occurred while accessing the database: {e}")
-
-# Regex for extracting index
-def extract_index(filename):
-    """Extract index from PDF name using regex."""
-    match = re.search(r'CKS\s*(\d+)(?:-(\d{8})(?:\(\d+\))?)?\s*(?:\.pdf)?$', filename)
-    return match.group(1) if match else None
-
-# Recursive function to explore folder and its subfolders
-def explore_folder(service, folder_id, tableview, parent_node=None):
-    """Recursively explore a folder and list files in all its subfolders."""
-    file_count = 0
-    page_token = None
-
-    while True:
-        try:
-            query = f"'{folder_id}' in parents and trashed=false"
-            response = service.files().list(
-                q=query,
-                fields="nextPageToken, files(id, name, mimeType, webViewLink, parents)",
-                pageToken=page_token
-            ).execute()
-
-            files = response.get('files', [])
-            if not files:
-                break
-
-            for item in files:
-                if item['mimeType'] == 'application/vnd.google-apps.folder':
-                    folder_file_count = explore_folder(service, item['id'], tableview, parent_node)
-                    file_count += folder_file_count
-                else:
-                    index = extract_index(item['name'])
-                    folder_name = get_folder_name(service, item['parents'][0])
-                    
-                    # Handle NoneType for index
-                    if index is None:
-                        index = "N/A"  # Use a placeholder or skip this file
-                    
-                    insert_into_db(item['name'], index, folder_name, item['webViewLink'])
-                    
-                    # Update Tableview
-                    row = [(item['name'], index, folder_name, item['webViewLink'])]
-                    tableview.insert_rows("end", row)  # Append rows to the end
-
-                    file_count += 1
-
-            page_token = response.get('nextPageToken', None)
-            if not page_token:
-                break
-        except HttpError as error:
-            messagebox.showerror("Error", f"Failed to fetch files: {error}")
-            break
-        except Exception as e:
-            messagebox.showerror("Unexpected Error", f"An unexpected error occurred: {str(e)}")
-            break
-
-    return file_count
-
-
-# Get the folder name using the folder ID
-def get_folder_name(service, folder_id):
-    """Get the folder name using the folder ID."""
-    folder = service.files().get(fileId=folder_id, fields='name').execute()
-    return folder['name']
-
-# Fetch Folders from Google Drive
-def fetch_drive_folders(service):
-    """Fetch folders from Google Drive."""
-    try:
-        # List all folders in the Drive (excluding trashed ones)
-        results = service.files().list(
-            q="mimeType='application/vnd.google-apps.folder' and trashed=false",
-            fields="files(id, name)"
-        ).execute()
-        
-        folders = results.get('files', [])
-        return folders
-    except HttpError as error:
-        messagebox.showerror("Error", f"Failed to fetch folders: {error}")
-        return []
+from drivecrawler.crawl import FolderCache, document_row, fetch_drive_folders
+from drivecrawler.db import DB_PATH, DocumentWriter, init_db
+from drivecrawler.folders import FolderIndex
+from drivecrawler.query import PAGE_SIZE, SORT_COLUMNS, DocumentPager
+from drivecrawler.service import READONLY_SCOPES, service_pool, worker_service
+from drivecrawler.sync import sync, synced_roots
+from folder_picker import FolderPicker
+
+# Rows inserted into the Tableview per refresh, and the refresh interval in milliseconds
+UI_CHUNK_SIZE = 500
+UI_REFRESH_MS = 100
 
 # GUI Components
 class DriveGUI:
@@ -143,13 +26,22 @@ class DriveGUI:
         self.root = root
         self.root.title("Google Drive to SQLite")
 
-        # Authenticate and set up the Google Drive service
-        creds = authenticate()
-        self.service = build('drive', 'v3', credentials=creds)
+        # Authentication is deferred until the first action that needs Drive
+
+        # Crawls run on a worker thread that hands events to the UI through this queue
+        self.events = queue.Queue()
+        self.cancel_event = None
 
         # Initialize the SQLite database
         init_db()
 
+        # Folder names are cached across crawls and persisted alongside the documents
+        self.folder_cache = FolderCache(db_path=DB_PATH)
+        self.folder_cache.load()
+
+        # Every Drive folder, fetched once per session for the folder picker
+        self.folder_index = None
+
         # Create a button to load folders and display data
         self.load_button = ttkb.Button(root, text="Select Folders", command=self.select_folders)
         self.load_button.pack(pady=10)
@@ -160,92 +52,193 @@ class DriveGUI:
             {"text": "Index", "stretch": False},
             {"text": "Folder", "stretch": False},
             {"text": "URL", "stretch": False}
-        ], rowdata=[], paginated=True, searchable=True, bootstyle="PRIMARY")
+        ], rowdata=[], paginated=False, searchable=False, bootstyle="PRIMARY")
         self.tableview.pack(fill="both", expand=True, padx=5, pady=5)
 
+        # Paging, sorting and search run as SQL queries through a DocumentPager,
+        # so the table only ever holds one page of the database
+        self.pager = None
+        browse_frame = ttkb.Frame(root)
+        browse_frame.pack(fill="x", padx=5)
+        self.search_var = tk.StringVar()
+        search_entry = ttkb.Entry(browse_frame, textvariable=self.search_var)
+        search_entry.pack(side="left", fill="x", expand=True)
+        search_entry.bind("<Return>", lambda event: self.load_data())
+        self.sort_var = tk.StringVar(value="name")
+        ttkb.Combobox(browse_frame, textvariable=self.sort_var, values=list(SORT_COLUMNS),
+                      state="readonly", width=10).pack(side="left", padx=5)
+        self.descending_var = tk.BooleanVar(value=False)
+        ttkb.Checkbutton(browse_frame, text="Descending", variable=self.descending_var).pack(side="left", padx=5)
+        ttkb.Button(browse_frame, text="<", command=self.previous_page).pack(side="left")
+        self.page_label = ttkb.Label(browse_frame, text="", width=10, anchor="center")
+        self.page_label.pack(side="left")
+        ttkb.Button(browse_frame, text=">", command=self.next_page).pack(side="left")
+
         self.load_data_button = ttkb.Button(root, text="Load Data", command=self.load_data)
         self.load_data_button.pack(pady=10)
 
+        self.sync_button = ttkb.Button(root, text="Sync Changes", command=self.sync_all)
+        self.sync_button.pack(pady=10)
+
+        self.cancel_button = ttkb.Button(root, text="Cancel", command=self.cancel, state="disabled")
+        self.cancel_button.pack(pady=10)
+
+        self.status_label = ttkb.Label(root, text="")
+        self.status_label.pack(pady=5)
+
+    def service_factory(self):
+        """Return the shared Drive service pool, authenticating on first use."""
+        return service_pool(READONLY_SCOPES)
+
     def select_folders(self):
         """Display a popup to select folders."""
-        folders = fetch_drive_folders(self.service)
-        if not folders:
+        if self.folder_index is None:
+            try:
+                self.folder_index = FolderIndex(fetch_drive_folders(worker_service(self.service_factory())))
+            except HttpError as error:
+                messagebox.showerror("Error", f"Failed to fetch folders: {error}")
+                return
+        if not len(self.folder_index):
             return
 
-        # Create popup window
-        popup = tk.Toplevel(self.root)
-        popup.title("Select Folders")
-        popup.geometry("400x400")
-
-        # Add search bar
-        search_var = tk.StringVar()
-        search_bar = tk.Entry(popup, textvariable=search_var)
-        search_bar.pack(fill="x", padx=5, pady=5)
-
-        # Create a frame for checkboxes
-        checkboxes_frame = ttkb.Frame(popup)
-        checkboxes_frame.pack(fill="both", expand=True, padx=5, pady=5)
-
-        # Dictionary to hold the selected folder ids
-        selected_folders = {}
-
-        # Function to create a checkbox for each folder
-        def create_checkbox(folder):
-            folder_name = folder['name']
-            folder_id = folder['id']
-            var = tk.BooleanVar()
-            checkbox = ttkb.Checkbutton(checkboxes_frame, text=folder_name, variable=var)
-            checkbox.pack(anchor="w")
-            selected_folders[folder_id] = var
-
-        # Create checkboxes for each folder
-        for folder in folders:
-            create_checkbox(folder)
-
-        # Search functionality to filter folders
-        def filter_folders():
-            query = search_var.get().lower()
-            for checkbox in checkboxes_frame.winfo_children():
-                checkbox.pack_forget()  # Remove all checkboxes
-            for folder in folders:
-                if query in folder['name'].lower():
-                    create_checkbox(folder)  # Add checkbox if name matches search
-
-        search_bar.bind("<KeyRelease>", lambda event: filter_folders())
-
-        # Add button to confirm selection
-        def confirm_selection():
-            selected_ids = [folder_id for folder_id, var in selected_folders.items() if var.get()]
-            for folder_id in selected_ids:
-                self.process_folder(folder_id)
-            popup.destroy()
-
-        confirm_button = ttkb.Button(popup, text="Confirm", command=confirm_selection)
-        confirm_button.pack(pady=10)
-
-    def process_folder(self, folder_id):
-        """Process files in a selected folder."""
-        files = explore_folder(self.service, folder_id, self.tableview)  # Pass self.tableview to explore_folder
-        if files == 0:
-            messagebox.showinfo("No Files", "The selected folder contains no files.")
-        else:
-            messagebox.showinfo("Success", f"Folder processed and stored in database!")
+        def confirm_selection(folders):
+            selected_ids = [folder['id'] for folder in folders]
+            if selected_ids:
+                self.process_folders(selected_ids)
+
+        FolderPicker(self.root, self.folder_index, confirm_selection)
+
+    def _start_sync(self, folder_ids, on_done):
+        """Crawl or sync folders on a worker thread, then call ``on_done`` with the results."""
+        if self.cancel_event is not None:
+            return  # a crawl is already running
+        factory = self.service_factory()
+        self.cancel_event = threading.Event()
+        self.file_count = 0
+        self.recent_rows = deque(maxlen=PAGE_SIZE)
+        self.started = time.monotonic()
+        for button in (self.load_button, self.sync_button):
+            button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        threading.Thread(target=self._run_sync, args=(factory, folder_ids, self.cancel_event), daemon=True).start()
+        self.root.after(UI_REFRESH_MS, self._drain_events, on_done)
+
+    def _run_sync(self, factory, folder_ids, cancel_event):
+        """Worker thread: run the sync, posting every event to the UI queue."""
+        results = {}
+        writer = DocumentWriter()
+        writer.start()
+        try:
+            results = sync(factory, folder_ids, writer, self.events.put, folder_cache=self.folder_cache,
+                           cancel=cancel_event)
+        except Exception as e:
+            self.events.put({'type': 'error', 'folder_id': None, 'error': e})
+        finally:
+            try:
+                writer.close()
+            except sqlite3.Error as e:
+                self.events.put({'type': 'db_error', 'error': e})
+            self.folder_cache.save()
+            self.events.put({'type': 'finished', 'result': results})
+
+    def _drain_events(self, on_done):
+        """Move queued rows into the Tableview in chunks and update the status line."""
+        rows = []
+        finished = None
+        while len(rows) < UI_CHUNK_SIZE:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event['type'] == 'file':
+                rows.append(document_row(event['item']))
+            elif event['type'] == 'error':
+                messagebox.showerror("Error", f"Failed to fetch files: {event['error']}")
+            elif event['type'] == 'db_error':
+                messagebox.showerror("Database Error", f"An error occurred while accessing the database: {event['error']}")
+            elif event['type'] == 'finished':
+                finished = event
+                break
+
+        if rows:
+            # The table is unpaginated, so during a crawl it shows a window of the latest files
+            self.recent_rows.extend(rows)
+            self.tableview.delete_rows()
+            self.tableview.insert_rows("end", list(self.recent_rows))  # One insert and one redraw per chunk
+            self.tableview.load_table_data()
+            self.file_count += len(rows)
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.status_label.configure(text=f"{self.file_count} files ({self.file_count / elapsed:.1f}/s)")
+
+        if finished is None:
+            self.root.after(UI_REFRESH_MS, self._drain_events, on_done)
+            return
+        cancelled = self.cancel_event.is_set()
+        self.cancel_event = None
+        for button in (self.load_button, self.sync_button):
+            button.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
+        if cancelled:
+            self.status_label.configure(text=f"Cancelled after {self.file_count} files")
+            return
+        on_done(list(finished['result'].values()))
+
+    def cancel(self):
+        """Stop the running crawl after the requests already in flight."""
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.configure(state="disabled")
+
+    def process_folders(self, folder_ids):
+        """Crawl the selected folders, or sync them if crawled before, and store their files."""
+        def on_done(results):
+            if sum(result['stored'] for result in results) == 0:
+                messagebox.showinfo("No Files", "The selected folders contain no new files.")
+            else:
+                messagebox.showinfo("Success", f"Folders processed and stored in database!")
+
+        self._start_sync(folder_ids, on_done)
+
+    def sync_all(self):
+        """Apply Drive changes to every previously crawled folder."""
+        roots = synced_roots()
+        if not roots:
+            messagebox.showinfo("Nothing to Sync", "Select and crawl folders first.")
+            return
+
+        def on_done(results):
+            stored = sum(result['stored'] for result in results)
+            removed = sum(result['removed'] for result in results)
+            messagebox.showinfo("Sync Complete", f"{stored} files updated, {removed} removed.")
+
+        self._start_sync(roots, on_done)
 
     def load_data(self):
-        """Load and display data from SQLite database into Tableview."""
-        db_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "documents.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, doc_index, folder, url FROM documents")  # Ensure columns match Tableview
-        rows = cursor.fetchall()
-        conn.close()
-
-        # Clear existing data in Tableview
-        self.tableview.delete_rows()  # Clear all rows in Tableview
+        """Show the first page of the database with the current search and sort order."""
+        if self.pager is None:
+            self.pager = DocumentPager(DB_PATH)
+        rows = self.pager.set_query(self.sort_var.get(), self.descending_var.get(), self.search_var.get())
+        self._show_page(rows)
 
-        # Insert new data into Tableview
-        for row in rows:
-            self.tableview.insert_rows("end", [row])  # Insert rows one at a time
+    def _show_page(self, rows):
+        self.tableview.delete_rows()  # Clear all rows in Tableview
+        self.tableview.insert_rows("end", rows)
+        self.tableview.load_table_data()
+        self.page_label.configure(text=f"Page {self.pager.page_number}")
+
+    def next_page(self):
+        """Show the next page of the loaded data."""
+        if self.pager is not None:
+            rows = self.pager.next_page()
+            if rows:
+                self._show_page(rows)
+
+    def previous_page(self):
+        """Show the previous page of the loaded data."""
+        if self.pager is not None:
+            rows = self.pager.previous_page()
+            if rows:
+                self._show_page(rows)
 
 
 # Main Application
@@ -0,0 +1,9 @@
+"""Headless core of the Drive crawler and mover.
+
+Crawling (``drivecrawler.crawl``), syncing (``drivecrawler.sync``) and
+migrating (``drivecrawler.migrate``) live here without any tkinter
+dependency; ``crawler.py`` and ``mover4.py`` are GUI front ends over the same
+functions, and ``python -m drivecrawler`` is the command line front end.
+``python -m drivecrawler.bench`` times them against an in-process simulated
+Drive (``drivecrawler.simulator``).
+"""
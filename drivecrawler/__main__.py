@@ -0,0 +1,5 @@
+import sys
+
+from drivecrawler.cli import main
+
+sys.exit(main())
@@ -0,0 +1,192 @@
+"""Offline benchmarks of crawling, syncing and migrating against a SimulatedDrive.
+
+``python -m drivecrawler.bench [options] [SCENARIO ...]`` runs each scenario
+on a freshly generated drive and temporary databases and reports wall time,
+Drive API calls, scheduler retries and throttles, peak Python memory (via
+tracemalloc, which also slows the run down somewhat) and time spent
+committing to SQLite. Compare runs of the same options before and after a
+change to measure a regression or speedup.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from drivecrawler import metrics, scheduler
+from drivecrawler.crawl import CRAWL_WORKERS, CrawlCheckpoint, crawl
+from drivecrawler.db import DocumentWriter, init_db
+from drivecrawler.migrate import ManifestProgress, plan_migration, run_moves, save_manifest
+from drivecrawler.simulator import ROOT_ID, SimulatedDrive
+from drivecrawler.snapshot import snapshot_crawl
+from drivecrawler.sync import sync
+
+# Fraction of files renamed, trashed or added between the initial and the measured sync
+SYNC_CHANGE_FRACTION = 0.05
+
+# Scheduler rate used unless --rate is given; high enough that the simulated latency dominates
+BENCH_RATE = 1000.0
+
+def _documents_db(workdir):
+    db_path = os.path.join(workdir, 'documents.db')
+    init_db(db_path)
+    return db_path
+
+# Every scenario prepares its drive and databases and returns the step to measure,
+# which returns (items processed, seconds spent in SQLite)
+
+def crawl_scenario(drive, workdir, workers):
+    """Full crawl of the drive into documents.db, with checkpoints."""
+    db_path = _documents_db(workdir)
+
+    def run():
+        with DocumentWriter(db_path) as writer:
+            counts = crawl(lambda: drive, [ROOT_ID], writer, max_workers=workers,
+                           checkpoint=CrawlCheckpoint(writer, db_path))
+        return sum(counts.values()), writer.flush_seconds
+    return run
+
+def snapshot_scenario(drive, workdir, workers):
+    """Crawl of the drive from one flat listing into documents.db."""
+    db_path = _documents_db(workdir)
+
+    def run():
+        with DocumentWriter(db_path) as writer:
+            counts = snapshot_crawl(drive, [ROOT_ID], writer)
+        return sum(counts.values()), writer.flush_seconds
+    return run
+
+def sync_scenario(drive, workdir, workers):
+    """Incremental sync after SYNC_CHANGE_FRACTION of the files changed."""
+    db_path = _documents_db(workdir)
+    with DocumentWriter(db_path) as writer:
+        sync(lambda: drive, [ROOT_ID], writer, db_path=db_path, max_workers=workers)
+
+    chooser = random.Random(0)
+    files = drive.ids()
+    folders = drive.ids(folders=True) or [ROOT_ID]
+    for n, file_id in enumerate(chooser.sample(files, int(len(files) * SYNC_CHANGE_FRACTION))):
+        if n % 3 == 0:
+            drive.rename(file_id, f"CKS {chooser.randrange(1000000, 99999999)}-01012025.pdf")
+        elif n % 3 == 1:
+            drive.trash(file_id)
+        else:
+            drive.add_file(chooser.choice(folders))
+
+    def run():
+        with DocumentWriter(db_path) as writer:
+            results = sync(lambda: drive, [ROOT_ID], writer, db_path=db_path, max_workers=workers)
+        stats = results[ROOT_ID]
+        return stats['stored'] + stats['removed'], writer.flush_seconds
+    return run
+
+def migrate_scenario(drive, workdir, workers):
+    """Plan, save and run the moves of every file into one destination folder."""
+    manifest_db = os.path.join(workdir, 'migration.db')
+    destination_id = drive.add_folder(ROOT_ID, "Destination")
+
+    def run():
+        manifest = plan_migration(drive, [ROOT_ID], destination_id)
+        started = time.perf_counter()
+        save_manifest(manifest, manifest_db)
+        save_seconds = time.perf_counter() - started
+        with ManifestProgress(manifest_db) as progress:
+            run_moves(lambda: drive, manifest, progress.record)
+        return len(manifest), save_seconds + progress.flush_seconds
+    return run
+
+SCENARIOS = {
+    'crawl': crawl_scenario,
+    'snapshot': snapshot_scenario,
+    'sync': sync_scenario,
+    'migrate': migrate_scenario,
+}
+
+def run_scenario(name, drive_options, workers=CRAWL_WORKERS, rate=BENCH_RATE, trace_memory=True,
+                 collect_metrics=False):
+    """Run one scenario on a new SimulatedDrive and return its measurements.
+
+    With ``collect_metrics`` the drivecrawler.metrics summary of the measured
+    step is included under ``metrics``.
+    """
+    drive = SimulatedDrive(**drive_options)
+    with tempfile.TemporaryDirectory() as workdir:
+        step = SCENARIOS[name](drive, workdir, workers)
+        calls_before = dict(drive.calls)
+        shared = scheduler.configure(rate=rate, burst=max(1, int(rate)))
+        registry = metrics.enable() if collect_metrics else None
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            items, sqlite_seconds = step()
+            wall_seconds = time.perf_counter() - started
+            peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            metrics.disable()
+
+    calls = {method: count - calls_before.get(method, 0) for method, count in drive.calls.items()
+             if count > calls_before.get(method, 0)}
+    stats = shared.stats()
+    result = {
+        'scenario': name,
+        'items': items,
+        'wall_seconds': round(wall_seconds, 3),
+        'items_per_second': round(items / wall_seconds, 1) if wall_seconds else None,
+        'api_calls': sum(calls.values()),
+        'calls': calls,
+        'retries': stats['retries'],
+        'throttles': stats['throttles'],
+        'peak_memory_mb': round(peak_memory / 2 ** 20, 2) if peak_memory is not None else None,
+        'sqlite_seconds': round(sqlite_seconds, 3),
+    }
+    if registry is not None:
+        result['metrics'] = registry.summary()
+    return result
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='drivecrawler.bench',
+                                     description="Benchmark crawl, sync and migrate against a simulated Drive.")
+    parser.add_argument('scenarios', nargs='*', choices=[[]] + list(SCENARIOS), metavar='SCENARIO',
+                        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--depth', type=int, default=3, help="folder levels below the root (default: %(default)s)")
+    parser.add_argument('--fanout', type=int, default=5, help="subfolders per folder (default: %(default)s)")
+    parser.add_argument('--files', type=int, default=20, help="files per folder (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="seconds per simulated request (default: %(default)s)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="fraction of requests failing with 429 (default: %(default)s)")
+    parser.add_argument('--retry-after', type=float, help="Retry-After seconds sent with simulated 429s")
+    parser.add_argument('--workers', type=int, default=CRAWL_WORKERS, help="crawl worker threads (default: %(default)s)")
+    parser.add_argument('--rate', type=float, default=BENCH_RATE,
+                        help="scheduler requests per second (default: %(default)s)")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc for undisturbed timings")
+    parser.add_argument('--metrics', action='store_true',
+                        help="include the drivecrawler.metrics summary in the JSON results")
+    parser.add_argument('--json', action='store_true', help="print results as JSON lines")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    drive_options = {'depth': args.depth, 'fanout': args.fanout, 'files': args.files, 'latency': args.latency,
+                     'throttle_rate': args.throttle_rate, 'retry_after': args.retry_after}
+    for name in args.scenarios or SCENARIOS:
+        result = run_scenario(name, drive_options, args.workers, args.rate, not args.no_memory, args.metrics)
+        if args.json or args.metrics:
+            print(json.dumps(result))
+        else:
+            memory = f"{result['peak_memory_mb']:.1f} MB" if result['peak_memory_mb'] is not None else "-"
+            print(f"{name:<9} {result['items']:>8} items {result['wall_seconds']:>8.2f} s "
+                  f"{result['items_per_second'] or 0:>9.1f}/s {result['api_calls']:>6} calls "
+                  f"{result['retries']:>4} retries {result['throttles']:>4} throttles "
+                  f"{memory:>9} peak {result['sqlite_seconds']:>6.2f} s sqlite")
+            sys.stdout.flush()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Headless command line interface: ``python -m drivecrawler {crawl,sync,move,search}``."""
+import argparse
+import functools
+import json
+import logging
+import sys
+
+from drivecrawler import metrics, scheduler
+from drivecrawler.crawl import CRAWL_WORKERS, CrawlCheckpoint, crawl, interrupted_roots
+from drivecrawler.db import DB_PATH, DocumentWriter, JsonlWriter, init_db
+from drivecrawler.migrate import MANIFEST_DB, migrate
+from drivecrawler.query import SEARCH_LIMIT, search_documents
+from drivecrawler.service import FULL_SCOPES, READONLY_SCOPES, is_service_account_file, service_pool, worker_service
+from drivecrawler.shard import SHARD_THREADS, sharded_crawl
+from drivecrawler.snapshot import snapshot_crawl
+from drivecrawler.sync import sync, synced_roots
+
+logger = logging.getLogger('drivecrawler')
+
+# Log a progress line every this many files or moves
+PROGRESS_INTERVAL = 1000
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='drivecrawler',
+                                     description="Crawl, sync and move Google Drive folders without the GUI.")
+    parser.add_argument('--token', default='token.json', help="OAuth user token file (default: %(default)s)")
+    parser.add_argument('--credentials', default='credentials.json',
+                        help="OAuth client secrets, used when the token is missing (default: %(default)s)")
+    parser.add_argument('--service-account', metavar='KEYFILE',
+                        help="authenticate with a service account key instead of the user token")
+    parser.add_argument('--rate', type=float, default=scheduler.DEFAULT_RATE,
+                        help="Drive requests per second (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=scheduler.DEFAULT_CONCURRENCY,
+                        help="maximum Drive requests in flight (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=CRAWL_WORKERS,
+                        help="crawl worker threads (default: %(default)s)")
+    parser.add_argument('--metrics', action='store_true',
+                        help="time Drive calls and database writes and add the figures to the JSON summary")
+    parser.add_argument('--prometheus', metavar='PATH',
+                        help=f"keep a Prometheus textfile of the metrics at PATH, rewritten every "
+                             f"{metrics.EXPORT_INTERVAL:g}s (implies --metrics)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request retry")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = commands.add_parser('crawl', help="crawl folders in full")
+    crawl_parser.add_argument('folders', nargs='*', metavar='FOLDER_ID',
+                              help="roots to crawl (with --resume, default: every interrupted crawl)")
+    output = crawl_parser.add_mutually_exclusive_group()
+    output.add_argument('--db', default=DB_PATH, help="SQLite database to upsert into (default: documents.db)")
+    output.add_argument('--jsonl', metavar='PATH', help="write one JSON line per file instead ('-' for stdout)")
+    crawl_parser.add_argument('--snapshot', action='store_true',
+                              help="list the whole drive in one flat query instead of folder by folder; "
+                                   "faster when there are many small folders")
+    crawl_parser.add_argument('--resume', action='store_true',
+                              help="continue interrupted crawls from their saved frontier instead of starting over")
+    crawl_parser.add_argument('--shard', action='append', metavar='TOKEN_OR_KEYFILE',
+                              help="crawl in one process per --shard, each with this user token or service "
+                                   "account key and its own quota; repeat to add shards")
+    crawl_parser.add_argument('--shard-threads', type=int, default=SHARD_THREADS,
+                              help="listing threads per shard process (default: %(default)s)")
+
+    sync_parser = commands.add_parser('sync', help="apply Drive changes to previously synced folders")
+    sync_parser.add_argument('folders', nargs='*', metavar='FOLDER_ID',
+                             help="roots to sync; new ones are crawled in full (default: all synced roots)")
+    sync_parser.add_argument('--db', default=DB_PATH,
+                             help="SQLite database holding documents and sync state; syncs have no JSONL output")
+
+    move_parser = commands.add_parser('move', help="move every file below folders into a destination folder")
+    move_parser.add_argument('folders', nargs='*', metavar='FOLDER_ID')
+    move_parser.add_argument('--to', metavar='FOLDER_ID', help="destination folder")
+    move_parser.add_argument('--manifest', default=MANIFEST_DB, help="SQLite file to save the migration plan in")
+    move_parser.add_argument('--resume', action='store_true',
+                             help="run the saved manifest's unfinished moves instead of planning again")
+    search_parser = commands.add_parser('search', help="full-text search of crawled documents")
+    search_parser.add_argument('query', nargs='+', help="words or word prefixes of the name, index or folder")
+    search_parser.add_argument('--limit', type=int, default=SEARCH_LIMIT, help="maximum results (default: %(default)s)")
+    search_parser.add_argument('--db', default=DB_PATH, help="SQLite database to search")
+    return parser
+
+def shard_factories(args):
+    """Return a service factory maker per --shard, authenticating each here first.
+
+    User tokens that are missing or expired go through the OAuth flow in this
+    process, so shard processes never open a browser.
+    """
+    shards = []
+    for path in args.shard:
+        if is_service_account_file(path):
+            shard = functools.partial(service_pool, READONLY_SCOPES, args.token, args.credentials, path)
+        else:
+            shard = functools.partial(service_pool, READONLY_SCOPES, path, args.credentials)
+        shard()
+        shards.append(shard)
+    return shards
+
+def search(args):
+    """Print ranked search results as JSON lines."""
+    init_db(args.db)
+    for result in search_documents(" ".join(args.query), args.limit, args.db):
+        print(json.dumps(result))
+    return 0
+
+class ProgressLog:
+    """Event subscriber that logs errors and periodic progress."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+
+    def __call__(self, event):
+        if event['type'] == 'error':
+            self.errors += 1
+            logger.error("Failed to read folder %s: %s", event['folder_id'], event['error'])
+        elif event['type'] == 'planned':
+            logger.info("Planned %d moves", event['total'])
+        elif event['type'] in ('file', 'moved'):
+            if event.get('error') is not None:
+                self.errors += 1
+            self.count += 1
+            if self.count % PROGRESS_INTERVAL == 0:
+                logger.info("%d %s", self.count, "files" if event['type'] == 'file' else "moves")
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'crawl':
+        if args.resume and (args.jsonl or args.snapshot):
+            parser.error("--resume needs a database crawl")
+        if args.shard and args.snapshot:
+            parser.error("--shard cannot be combined with --snapshot")
+        if not args.folders and not args.resume:
+            parser.error("crawl needs at least one FOLDER_ID")
+    elif args.command == 'move' and not args.resume and not (args.folders and args.to):
+        parser.error("move needs FOLDER_IDs and --to unless resuming")
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    logger.setLevel(logging.INFO)
+    if args.command == 'search':
+        # Purely local: no credentials needed
+        return search(args)
+    scheduler.configure(rate=args.rate, max_concurrency=args.concurrency)
+    registry = None
+    if args.metrics or args.prometheus:
+        registry = metrics.enable()
+        if args.prometheus:
+            registry.start_export(args.prometheus)
+
+    scopes = FULL_SCOPES if args.command == 'move' else READONLY_SCOPES
+    # Shards authenticate with their own credentials
+    sharded = args.command == 'crawl' and args.shard
+    factory = None if sharded else service_pool(scopes, args.token, args.credentials, args.service_account)
+    progress = ProgressLog()
+    summary = sys.stdout
+
+    if args.command == 'crawl':
+        if args.jsonl:
+            writer = JsonlWriter(args.jsonl)
+            if args.jsonl == '-':
+                summary = sys.stderr
+        else:
+            init_db(args.db)
+            writer = DocumentWriter(args.db)
+        folders = args.folders or interrupted_roots(args.db)
+        with writer:
+            if args.snapshot:
+                result = snapshot_crawl(worker_service(factory), folders, writer, progress)
+            else:
+                checkpoint = None if args.jsonl else CrawlCheckpoint(writer, args.db, args.resume)
+                if args.shard:
+                    result = sharded_crawl(shard_factories(args), folders, writer, progress, args.shard_threads,
+                                           checkpoint, scheduler_options={'rate': args.rate,
+                                                                          'max_concurrency': args.concurrency})
+                else:
+                    result = crawl(factory, folders, writer, progress, args.workers, checkpoint=checkpoint)
+    elif args.command == 'sync':
+        init_db(args.db)
+        folders = args.folders or synced_roots(args.db)
+        with DocumentWriter(args.db) as writer:
+            result = sync(factory, folders, writer, progress, args.db, args.workers)
+    else:
+        result = migrate(factory, args.folders, args.to, progress, args.manifest, args.resume)
+
+    report = {'command': args.command, 'result': result, 'errors': progress.errors,
+              'scheduler': scheduler.scheduler.stats()}
+    if registry is not None:
+        metrics.disable()
+        if args.prometheus:
+            registry.write_prometheus(args.prometheus)
+        report['metrics'] = registry.summary()
+    print(json.dumps(report), file=summary)
+    return 1 if progress.errors else 0
@@ -0,0 +1,401 @@
+"""Concurrent breadth-first crawling of Drive folders."""
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from operator import itemgetter
+
+from drivecrawler import metrics
+from drivecrawler.db import DB_PATH
+from drivecrawler.events import emit
+from drivecrawler.listing import CRAWL_FIELDS, FOLDER_FIELDS, FOLDER_MIME, LIST_PAGE_SIZE, list_children, take_group
+from drivecrawler.scheduler import execute
+from drivecrawler.service import worker_service
+
+logger = logging.getLogger(__name__)
+
+# Regex for extracting index
+def extract_index(filename):
+    """Extract index from PDF name using regex."""
+    match = re.search(r'CKS\s*(\d+)(?:-(\d{8})(?:\(\d+\))?)?\s*(?:\.pdf)?$', filename)
+    return match.group(1) if match else None
+
+# Number of folder pages fetched concurrently during a crawl
+CRAWL_WORKERS = 8
+
+# Maximum number of folder names kept in memory by FolderCache
+FOLDER_CACHE_SIZE = 10000
+
+class FolderCache:
+    """Bounded LRU cache of folder names keyed by Drive folder ID.
+
+    Names are filled from the folder listings the crawler already fetches, so
+    a files().get is only issued for folders never seen in a listing (usually
+    just the crawl roots). Concurrent misses on the same folder wait for the
+    first fetch instead of repeating it. When ``db_path`` is given the cache
+    can be loaded from and saved to documents.db across runs.
+    """
+
+    def __init__(self, maxsize=FOLDER_CACHE_SIZE, db_path=None):
+        self.maxsize = maxsize
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetching = {}
+
+    def put(self, folder_id, name):
+        """Record the name of a folder, evicting the least recently used entry if full."""
+        with self._lock:
+            self._store(folder_id, name)
+
+    def _store(self, folder_id, name):
+        self._names[folder_id] = name
+        self._names.move_to_end(folder_id)
+        while len(self._names) > self.maxsize:
+            self._names.popitem(last=False)
+
+    def get_name(self, service, folder_id):
+        """Return the folder name, fetching it from Drive only on a cache miss."""
+        with self._lock:
+            if folder_id in self._names:
+                self.hits += 1
+                self._names.move_to_end(folder_id)
+                return self._names[folder_id]
+            fetch_lock = self._fetching.get(folder_id)
+            owner = fetch_lock is None
+            if owner:
+                self.misses += 1
+                fetch_lock = self._fetching[folder_id] = threading.Lock()
+                fetch_lock.acquire()
+
+        if not owner:
+            # Another worker is already fetching this folder; wait for its result
+            with fetch_lock:
+                pass
+            with self._lock:
+                if folder_id in self._names:
+                    self.hits += 1
+                    return self._names[folder_id]
+            # The first fetch failed, so try again ourselves
+            return get_folder_name(service, folder_id)
+
+        try:
+            name = get_folder_name(service, folder_id)
+            with self._lock:
+                self._store(folder_id, name)
+            return name
+        finally:
+            with self._lock:
+                del self._fetching[folder_id]
+            fetch_lock.release()
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._names)}
+
+    def load(self):
+        """Load persisted folder names from the database, if persistence is enabled."""
+        if not self.db_path:
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS folder_names (id TEXT PRIMARY KEY, name TEXT)")
+            rows = conn.execute("SELECT id, name FROM folder_names LIMIT ?", (self.maxsize,)).fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for folder_id, name in rows:
+                self._store(folder_id, name)
+
+    def save(self):
+        """Persist the cached folder names to the database, if persistence is enabled."""
+        if not self.db_path:
+            return
+        with self._lock:
+            rows = list(self._names.items())
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS folder_names (id TEXT PRIMARY KEY, name TEXT)")
+            conn.executemany("INSERT OR REPLACE INTO folder_names (id, name) VALUES (?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+class CrawlCheckpoint:
+    """Crawl frontier kept in documents.db so an interrupted crawl can resume.
+
+    Rows of crawl_frontier are folders still to list, with the page token to
+    continue from if their listing was part way through. Folders listed
+    together share a group key, and since Drive only accepts a page token
+    with the query it was issued for, a group is resumed whole or listed
+    again from its first page. Updates are queued on the crawl's
+    DocumentWriter after the files of the page they follow, so every writer
+    batch commits files and frontier together and an interrupted crawl loses
+    at most one batch. With ``resume`` set, roots that have a saved frontier
+    continue from it and the rest start over.
+    """
+
+    def __init__(self, writer, db_path=DB_PATH, resume=False):
+        self.writer = writer
+        self.db_path = db_path
+        self.resume = resume
+
+    def frontier(self, folder_ids):
+        """Return the (root, folder) pairs to list and the (group, page token) listings to continue."""
+        rows = []
+        split = set()
+        if self.resume:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                for root_id in folder_ids:
+                    rows += conn.execute("SELECT root_id, folder_id, page_token, group_key FROM crawl_frontier "
+                                         "WHERE root_id = ?", (root_id,)).fetchall()
+                # Groups that also hold folders of roots not resumed now cannot be continued
+                for group_key in {group_key for _, _, page_token, group_key in rows if page_token is not None}:
+                    roots = conn.execute("SELECT DISTINCT root_id FROM crawl_frontier WHERE group_key = ?",
+                                         (group_key,)).fetchall()
+                    if any(root_id not in folder_ids for root_id, in roots):
+                        split.add(group_key)
+            finally:
+                conn.close()
+        for group_key in split:
+            self._restart_groups("group_key = ?", group_key)
+        resumed = {root_id for root_id, _, _, _ in rows}
+        for root_id in folder_ids:
+            if root_id not in resumed:
+                self._restart_groups("root_id = ?", root_id)
+                self.writer.execute("DELETE FROM crawl_frontier WHERE root_id = ?", (root_id,))
+                self.writer.execute("INSERT INTO crawl_frontier (root_id, folder_id, page_token, group_key) "
+                                    "VALUES (?, ?, NULL, NULL)", (root_id, root_id))
+                rows.append((root_id, root_id, None, None))
+
+        pending = deque()
+        groups = {}
+        for root_id, folder_id, page_token, group_key in rows:
+            if page_token is None or group_key in split:
+                pending.append((root_id, folder_id))
+            else:
+                group, _ = groups.setdefault(group_key, ([], page_token))
+                group.append((root_id, folder_id))
+        continued = deque(groups.values())
+        return pending, continued
+
+    def _restart_groups(self, where, value):
+        """Drop the page tokens of every group holding a frontier row that matches ``where``."""
+        self.writer.execute("UPDATE crawl_frontier SET page_token = NULL, group_key = NULL WHERE group_key IN "
+                            f"(SELECT group_key FROM crawl_frontier WHERE {where})", (value,))
+
+    def page_done(self, group, page_token, subfolders):
+        """Record that a page of ``group`` was stored and ``subfolders`` were found in it."""
+        # A (root, folder) pair is in one listing at a time, so the first one names the group
+        group_key = "/".join(min(group))
+        for root_id, folder_id in group:
+            if page_token:
+                self.writer.execute("UPDATE crawl_frontier SET page_token = ?, group_key = ? "
+                                    "WHERE root_id = ? AND folder_id = ?", (page_token, group_key, root_id, folder_id))
+            else:
+                self.writer.execute("DELETE FROM crawl_frontier WHERE root_id = ? AND folder_id = ?",
+                                    (root_id, folder_id))
+        for root_id, folder_id in subfolders:
+            self.writer.execute("INSERT OR IGNORE INTO crawl_frontier (root_id, folder_id, page_token, group_key) "
+                                "VALUES (?, ?, NULL, NULL)", (root_id, folder_id))
+
+def interrupted_roots(db_path=DB_PATH):
+    """Return the roots of crawls that stopped before finishing."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT root_id FROM crawl_frontier")]
+    finally:
+        conn.close()
+
+def fetch_page(service_factory, folder_cache, folder_ids, page_token):
+    """Fetch one page of the combined listing of some folders and resolve folder names for its files."""
+    service = worker_service(service_factory)
+    children, page_token = list_children(service, folder_ids, CRAWL_FIELDS, page_token)
+
+    # Subfolders in this page are the parents of the next level's files
+    for files in children.values():
+        for item in files:
+            if item['mimeType'] == FOLDER_MIME:
+                folder_cache.put(item['id'], item['name'])
+    for folder_id, files in children.items():
+        folder_name = None
+        for item in files:
+            if item['mimeType'] != FOLDER_MIME:
+                if folder_name is None:
+                    folder_name = folder_cache.get_name(service, folder_id)
+                item['folderName'] = folder_name
+    return children, page_token
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+def document_row(item):
+    """Return the (name, index, folder, url) row shown for a crawled file."""
+    return (item['name'], item['docIndex'], item['folderName'], item['webViewLink'])
+
+def next_listing(pending, continued, idle):
+    """Pop the next listing to request as (group, page token).
+
+    Continued listings go first; otherwise the pending (root, folder) pairs
+    are spread over ``idle`` workers.
+    """
+    if continued:
+        return continued.popleft()
+    return take_group(pending, max_folders=-(-len(pending) // idle), folder_of=itemgetter(1)), None
+
+def group_folders(group):
+    """Return the distinct folder IDs of a group of (root, folder) pairs, sorted.
+
+    Sorting makes the parents query of a group the same however its pairs
+    are ordered, so a page token saved by a CrawlCheckpoint is resumed with
+    the query it was issued for.
+    """
+    return sorted({folder_id for _, folder_id in group})
+
+def record_page(group, children, page_token, pending, continued, counts, on_file, on_folder=None, checkpoint=None):
+    """Report the files of a listed page and queue its subfolders and next page.
+
+    Returns the (root, folder) pairs of the subfolders found.
+    """
+    if page_token:
+        continued.append((group, page_token))
+
+    subfolders = []
+    files = 0
+    for root_id, folder_id in group:
+        for item in children[folder_id]:
+            if item['mimeType'] == FOLDER_MIME:
+                subfolders.append((root_id, item['id']))
+                if on_folder is not None:
+                    on_folder(item)
+            else:
+                index = extract_index(item['name'])
+
+                # Handle NoneType for index
+                if index is None:
+                    index = "N/A"  # Use a placeholder or skip this file
+
+                item['docIndex'] = index
+                item['rootId'] = root_id
+                on_file(item)
+                counts[root_id] += 1
+                files += 1
+    pending.extend(subfolders)
+    if metrics.registry is not None:
+        metrics.registry.count('items_total', files, kind='file')
+        if not page_token:
+            metrics.registry.count('folders_listed_total', len(group))
+        metrics.registry.gauge('crawl_frontier', len(pending) + sum(len(g) for g, _ in continued))
+    if checkpoint is not None:
+        checkpoint.page_done(group, page_token, subfolders)
+    return subfolders
+
+def crawl_folders(service_factory, folder_ids, on_file, max_workers=CRAWL_WORKERS, folder_cache=None,
+                  on_folder=None, on_error=None, cancel=None, checkpoint=None):
+    """Breadth-first crawl of the given folders using a pool of worker threads.
+
+    Folders waiting to be listed are spread over the idle workers, each
+    request listing a group of sibling folders at once through one OR'd
+    parents query (see listing.take_group), and at most ``max_workers`` list
+    requests are in flight at once. ``on_file`` is called from the calling
+    thread with the Drive item of every file found, with ``docIndex``,
+    ``folderName`` and ``rootId`` filled in; ``on_folder``, if given, gets
+    every subfolder. A listing page that cannot be fetched is skipped and
+    each of its folders is reported to ``on_error`` as (folder ID,
+    exception), or logged if no handler is given. Folder names are resolved
+    through ``folder_cache`` (a fresh FolderCache if not given). Setting the
+    ``cancel`` event stops new requests; pages already in flight are still
+    reported. A CrawlCheckpoint, if given, supplies the starting frontier and
+    records every page. Returns a dict of file counts keyed by root folder ID.
+    """
+    if folder_cache is None:
+        folder_cache = FolderCache()
+    counts = {folder_id: 0 for folder_id in folder_ids}
+    # (root, folder) pairs not listed yet, and (group, page token) listings with more pages
+    if checkpoint is None:
+        pending = deque((folder_id, folder_id) for folder_id in folder_ids)
+        continued = deque()
+    else:
+        pending, continued = checkpoint.frontier(folder_ids)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while in_flight or ((pending or continued) and not _cancelled(cancel)):
+            while (pending or continued) and len(in_flight) < max_workers and not _cancelled(cancel):
+                group, page_token = next_listing(pending, continued, max_workers - len(in_flight))
+                future = pool.submit(fetch_page, service_factory, folder_cache, group_folders(group), page_token)
+                in_flight[future] = group
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = in_flight.pop(future)
+                try:
+                    children, page_token = future.result()
+                except Exception as error:
+                    for _, folder_id in group:
+                        if on_error is None:
+                            logger.error("Failed to fetch files of folder %s: %s", folder_id, error)
+                        else:
+                            on_error(folder_id, error)
+                    continue
+
+                record_page(group, children, page_token, pending, continued, counts, on_file, on_folder,
+                             checkpoint)
+
+    return counts
+
+def explore_folder(service_factory, folder_id, on_file, max_workers=CRAWL_WORKERS, folder_cache=None):
+    """Explore a folder and all its subfolders, returning the number of files found."""
+    return crawl_folders(service_factory, [folder_id], on_file, max_workers, folder_cache)[folder_id]
+
+# Get the folder name using the folder ID
+def get_folder_name(service, folder_id):
+    """Get the folder name using the folder ID."""
+    folder = execute(service.files().get(fileId=folder_id, fields='name'))
+    return folder['name']
+
+# Fetch Folders from Google Drive
+def fetch_drive_folders(service, fields=FOLDER_FIELDS):
+    """Fetch every folder from Google Drive, following all result pages."""
+    # List all folders in the Drive (excluding trashed ones)
+    folders = []
+    page_token = None
+    while True:
+        results = execute(service.files().list(
+            q="mimeType='application/vnd.google-apps.folder' and trashed=false",
+            fields=fields,
+            pageSize=LIST_PAGE_SIZE,
+            pageToken=page_token
+        ))
+        folders.extend(results.get('files', []))
+        page_token = results.get('nextPageToken', None)
+        if not page_token:
+            return folders
+
+def crawl(service_factory, folder_ids, writer=None, on_event=None, max_workers=CRAWL_WORKERS, folder_cache=None,
+          cancel=None, checkpoint=None):
+    """Crawl the given folders in full, storing every file through ``writer``.
+
+    ``writer`` is a DocumentWriter or JsonlWriter, or None to only report
+    files; pass a CrawlCheckpoint on the same DocumentWriter to make the
+    crawl resumable. Emits ``file``, ``error`` and ``done`` events to ``on_event`` and
+    returns a dict of file counts keyed by root folder ID.
+    """
+    def on_file(item):
+        if writer is not None:
+            writer.write(item)
+        emit(on_event, 'file', root_id=item['rootId'], item=item)
+
+    def on_error(folder_id, error):
+        emit(on_event, 'error', folder_id=folder_id, error=error)
+
+    counts = crawl_folders(service_factory, folder_ids, on_file, max_workers, folder_cache,
+                           on_error=on_error, cancel=cancel, checkpoint=checkpoint)
+    emit(on_event, 'done', result=counts)
+    return counts
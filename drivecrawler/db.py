@@ -0,0 +1,331 @@
+"""SQLite storage for crawl results."""
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from itertools import groupby
+
+from drivecrawler import metrics
+
+# documents.db lives at the top of the repository, next to the GUI scripts
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "documents.db")
+
+# Rows buffered by DocumentWriter before a flush, and the longest a row may wait
+WRITE_BATCH_SIZE = 1000
+WRITE_FLUSH_INTERVAL = 1.0
+
+# Bumped whenever init_db gains a migration step
+SCHEMA_VERSION = 5
+
+def init_db(db_path=DB_PATH):
+    """Initialize SQLite database in the same directory as the script."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS documents (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT,
+                        doc_index TEXT,    -- Renamed from 'index' to 'doc_index'
+                        folder TEXT,
+                        url TEXT,
+                        drive_id TEXT,
+                        parent_id TEXT,
+                        modified_time TEXT,
+                        size INTEGER)''')
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        _migrate_documents(cursor)
+    if version < 2:
+        _add_browse_indexes(cursor)
+    if version < 3:
+        _add_search_index(cursor)
+    if version < 4:
+        _fill_sort_keys(cursor)
+    if version < 5:
+        _key_frontier_groups(cursor)
+    if version < SCHEMA_VERSION:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    # Changes-feed position and known folder tree for every synced root
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                        root_id TEXT PRIMARY KEY,
+                        page_token TEXT,
+                        synced_at TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS synced_folders (
+                        root_id TEXT,
+                        id TEXT,
+                        parent_id TEXT,
+                        name TEXT,
+                        PRIMARY KEY (root_id, id))''')
+    # Folders still to list for every interrupted crawl, and the page to continue
+    # from with the key of the group of folders that page token was issued for
+    cursor.execute('''CREATE TABLE IF NOT EXISTS crawl_frontier (
+                        root_id TEXT,
+                        folder_id TEXT,
+                        page_token TEXT,
+                        group_key TEXT,
+                        PRIMARY KEY (root_id, folder_id))''')
+    conn.commit()
+    conn.close()
+
+def _drive_id_from_url(url):
+    """Extract the Drive file ID from a webViewLink, if it has one."""
+    match = re.search(r'/d/([\w-]+)|[?&]id=([\w-]+)', url or '')
+    return (match.group(1) or match.group(2)) if match else None
+
+def _migrate_documents(cursor):
+    """Upgrade documents to the keyed schema, dropping duplicate rows left by earlier crawls."""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(documents)")}
+    for column, column_type in (('drive_id', 'TEXT'), ('parent_id', 'TEXT'),
+                                ('modified_time', 'TEXT'), ('size', 'INTEGER')):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE documents ADD COLUMN {column} {column_type}")
+
+    # Rows from before drive_id was stored still carry the ID in their URL
+    legacy = cursor.execute("SELECT id, url FROM documents WHERE drive_id IS NULL").fetchall()
+    cursor.executemany("UPDATE documents SET drive_id = ? WHERE id = ?",
+                       [(_drive_id_from_url(url), row_id) for row_id, url in legacy])
+
+    # Keep the newest row per file
+    cursor.execute('''DELETE FROM documents WHERE drive_id IS NOT NULL AND id NOT IN (
+                        SELECT MAX(id) FROM documents WHERE drive_id IS NOT NULL GROUP BY drive_id)''')
+    cursor.execute('''DELETE FROM documents WHERE drive_id IS NULL AND id NOT IN (
+                        SELECT MAX(id) FROM documents WHERE drive_id IS NULL
+                        GROUP BY name, doc_index, folder, url)''')
+
+    cursor.execute("DROP INDEX IF EXISTS idx_documents_drive_id")
+    cursor.execute("CREATE UNIQUE INDEX idx_documents_drive_id ON documents (drive_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_parent_id ON documents (parent_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_doc_index ON documents (doc_index)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_folder ON documents (folder)")
+
+def _add_browse_indexes(cursor):
+    """Add the case-insensitive indexes DocumentPager sorts and prefix-searches on."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_name_nocase ON documents (name COLLATE NOCASE)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_folder_nocase ON documents (folder COLLATE NOCASE)")
+
+def _add_search_index(cursor):
+    """Add the documents_fts full-text index, kept in step with documents by triggers.
+
+    Skipped when SQLite was built without FTS5; search_documents then falls
+    back to LIKE queries.
+    """
+    try:
+        cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                            name, doc_index, folder,
+                            content='documents', content_rowid='id', prefix='2 3')''')
+    except sqlite3.OperationalError:
+        return
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+                        INSERT INTO documents_fts (rowid, name, doc_index, folder)
+                        VALUES (new.id, new.name, new.doc_index, new.folder);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+                        INSERT INTO documents_fts (documents_fts, rowid, name, doc_index, folder)
+                        VALUES ('delete', old.id, old.name, old.doc_index, old.folder);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF name, doc_index, folder
+                      ON documents BEGIN
+                        INSERT INTO documents_fts (documents_fts, rowid, name, doc_index, folder)
+                        VALUES ('delete', old.id, old.name, old.doc_index, old.folder);
+                        INSERT INTO documents_fts (rowid, name, doc_index, folder)
+                        VALUES (new.id, new.name, new.doc_index, new.folder);
+                      END''')
+    cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+
+def _fill_sort_keys(cursor):
+    """Replace NULL names, indexes and folders of legacy rows, which keyset paging cannot seek past."""
+    cursor.execute("UPDATE documents SET doc_index = 'N/A' WHERE doc_index IS NULL")
+    cursor.execute("UPDATE documents SET name = '' WHERE name IS NULL")
+    cursor.execute("UPDATE documents SET folder = '' WHERE folder IS NULL")
+
+def _key_frontier_groups(cursor):
+    """Add crawl_frontier.group_key, listing saved part-way folders again from their first page.
+
+    Their page tokens were saved without the group they were issued for, so
+    they cannot be resumed with the same query.
+    """
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crawl_frontier'").fetchone():
+        return
+    cursor.execute("ALTER TABLE crawl_frontier ADD COLUMN group_key TEXT")
+    cursor.execute("UPDATE crawl_frontier SET page_token = NULL")
+
+DOCUMENT_COLUMNS = ('drive_id', 'parent_id', 'name', 'doc_index', 'folder', 'url', 'modified_time', 'size')
+
+UPSERT_DOCUMENT = """INSERT INTO documents (drive_id, parent_id, name, doc_index, folder, url, modified_time, size)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                     ON CONFLICT (drive_id) DO UPDATE SET
+                        parent_id = excluded.parent_id,
+                        name = excluded.name,
+                        doc_index = excluded.doc_index,
+                        folder = excluded.folder,
+                        url = excluded.url,
+                        modified_time = excluded.modified_time,
+                        size = excluded.size"""
+
+def document_record(item):
+    """Return the stored columns of a crawled Drive file as a dict."""
+    size = item.get('size')
+    return {
+        'drive_id': item['id'],
+        'parent_id': item['parents'][0],
+        # Sort keys of DocumentPager, so never NULL
+        'name': item['name'] or '',
+        'doc_index': item['docIndex'] if item['docIndex'] is not None else 'N/A',
+        'folder': item['folderName'] or '',
+        'url': item['webViewLink'],
+        'modified_time': item.get('modifiedTime'),
+        'size': int(size) if size is not None else None,
+    }
+
+class DocumentWriter:
+    """Single-connection writer that stores crawl results in batches.
+
+    Statements are accepted from any thread through ``write``, ``delete`` and
+    ``execute`` and queued for a dedicated writer thread, which owns one
+    long-lived WAL-mode connection. It applies them in order, running
+    consecutive uses of the same statement as one ``executemany``, once
+    ``batch_size`` are buffered or ``flush_interval`` seconds have passed. Use
+    as a context manager, or call ``start`` and ``close``; ``close`` flushes
+    what is left and re-raises any database error hit by the writer thread.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path=DB_PATH, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.flush_seconds = 0.0
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread = threading.Thread(target=self._run, name="DocumentWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, item):
+        """Queue a crawled Drive file for storage, replacing any earlier row for it."""
+        record = document_record(item)
+        self._queue.put((UPSERT_DOCUMENT, tuple(record[column] for column in DOCUMENT_COLUMNS)))
+
+    def delete(self, file_id):
+        """Queue removal of the row for a Drive file."""
+        self._queue.put(("DELETE FROM documents WHERE drive_id = ?", (file_id,)))
+
+    def execute(self, sql, params=()):
+        """Queue an arbitrary statement, applied in order with the other writes."""
+        self._queue.put((sql, params))
+
+    def close(self):
+        """Flush any buffered rows and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            buffer = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    row = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    row = None
+                if row is self._STOP:
+                    self._flush(conn, buffer)
+                    return
+                if row is not None:
+                    buffer.append(row)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                if len(buffer) >= self.batch_size or (buffer and time.monotonic() >= deadline):
+                    self._flush(conn, buffer)
+                    buffer = []
+                    deadline = None
+        except sqlite3.Error as e:
+            self.error = e
+            # Keep draining so producers never block on a dead writer
+            while self._queue.get() is not self._STOP:
+                pass
+        finally:
+            conn.close()
+
+    def _flush(self, conn, statements):
+        if not statements:
+            return
+        started = time.perf_counter()
+        with conn:
+            for sql, group in groupby(statements, key=lambda statement: statement[0]):
+                conn.executemany(sql, [params for _, params in group])
+        seconds = time.perf_counter() - started
+        self.flush_seconds += seconds
+        self.rows_written += len(statements)
+        metrics.observe('sqlite_flush_seconds', seconds, store='documents')
+        metrics.count('sqlite_rows_total', len(statements), store='documents')
+
+class JsonlWriter:
+    """Writer with the DocumentWriter interface that emits one JSON line per file.
+
+    ``path`` of ``-`` writes to stdout; SQL statements are ignored. Only
+    crawls write JSON lines: syncs rewrite and delete stored rows by folder,
+    so they need a DocumentWriter.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows_written = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        """Open the output file."""
+        self._file = sys.stdout if self.path == '-' else open(self.path, 'a', encoding='utf-8')
+
+    def _write_line(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self.rows_written += 1
+
+    def write(self, item):
+        """Write a crawled Drive file as a JSON line."""
+        self._write_line(document_record(item))
+
+    def execute(self, sql, params=()):
+        """Ignored; JSON output has no database state."""
+
+    def close(self):
+        """Flush and close the output file."""
+        if self._file is None:
+            return
+        if self._file is sys.stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+        self._file = None
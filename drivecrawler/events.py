@@ -0,0 +1,17 @@
+"""Progress events emitted by crawl, sync and migrate.
+
+Callers subscribe by passing an ``on_event`` callable, which is invoked on
+the calling thread with a dict whose ``type`` is one of:
+
+- ``file``: a file was stored (``root_id``, ``item``)
+- ``error``: a folder or root could not be read (``folder_id``, ``error``)
+- ``planned``: a migration manifest is ready (``total``)
+- ``moved``: a migration move finished (``move``, ``error`` or None)
+- ``done``: the run finished (``result``)
+"""
+
+def emit(on_event, event_type, **fields):
+    """Deliver an event to ``on_event`` if there is a subscriber."""
+    if on_event is not None:
+        fields['type'] = event_type
+        on_event(fields)
@@ -0,0 +1,50 @@
+"""In-memory index of Drive folders for instant filtering in folder pickers."""
+from array import array
+from bisect import bisect_left, bisect_right
+
+class FolderIndex:
+    """Prefix and substring index over folder names.
+
+    Folders are kept sorted by lowercased name, so the names starting with a
+    search term form one contiguous range found by bisection. For substring
+    matches the lowercased names are joined into one newline-separated
+    string and scanned with ``str.find``, which runs at C speed, mapping each
+    hit back to its folder through the sorted start offsets.
+    """
+
+    def __init__(self, folders):
+        self.folders = sorted(folders, key=lambda folder: folder['name'].lower())
+        self._keys = [folder['name'].lower() for folder in self.folders]
+        self._text = "\n".join(self._keys)
+        self._starts = array('l')
+        offset = 0
+        for key in self._keys:
+            self._starts.append(offset)
+            offset += len(key) + 1
+
+    def __len__(self):
+        return len(self.folders)
+
+    def search(self, text):
+        """Return the positions in ``folders`` of names containing ``text``, case-insensitively.
+
+        Names starting with ``text`` come first, then the other matches, each
+        in name order. An empty search matches every folder.
+        """
+        text = text.strip().lower()
+        if not text:
+            return range(len(self.folders))
+        low = bisect_left(self._keys, text)
+        high = bisect_left(self._keys, text[:-1] + chr(ord(text[-1]) + 1), low)
+        matches = list(range(low, high))
+
+        position = self._text.find(text)
+        while position != -1:
+            n = bisect_right(self._starts, position) - 1
+            if not low <= n < high:
+                matches.append(n)
+            if n + 1 >= len(self._starts):
+                break
+            # One hit per name is enough: continue from the start of the next one
+            position = self._text.find(text, self._starts[n + 1])
+        return matches
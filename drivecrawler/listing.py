@@ -0,0 +1,196 @@
+"""Folder listings that fetch many sibling folders with one files().list query."""
+import threading
+import time
+from collections import deque
+
+from drivecrawler.scheduler import execute
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Largest page files().list will return
+LIST_PAGE_SIZE = 1000
+
+# Longest ``q`` sent in one listing; Drive rejects much longer queries and
+# the query string travels in the request URL
+MAX_QUERY_LENGTH = 2000
+
+# Listing filter applied on top of the parents clause
+NOT_TRASHED = "trashed=false"
+
+# Field masks per purpose; every mask that is fanned out by parent needs parents
+CRAWL_FIELDS = "nextPageToken, files(id, name, mimeType, parents, webViewLink, modifiedTime, size)"
+TREE_FIELDS = "nextPageToken, files(id, name, mimeType, parents)"
+PLAN_FIELDS = "nextPageToken, files(id, mimeType, parents)"
+BROWSE_FIELDS = "nextPageToken, files(id, name, mimeType, parents, webViewLink)"
+FOLDER_FIELDS = "nextPageToken, files(id, name)"
+FOLDER_LINK_FIELDS = "nextPageToken, files(id, name, webViewLink)"
+
+def _clause(folder_id):
+    return f"'{folder_id}' in parents"
+
+def parents_query(folder_ids, extra=NOT_TRASHED):
+    """Return a query matching the children of any of ``folder_ids``."""
+    query = " or ".join(_clause(folder_id) for folder_id in folder_ids)
+    if len(folder_ids) > 1:
+        query = f"({query})"
+    return f"{query} and {extra}" if extra else query
+
+def take_group(pending, max_folders=None, extra=NOT_TRASHED, folder_of=None):
+    """Pop entries off the front of ``pending`` while their parents query fits in MAX_QUERY_LENGTH.
+
+    ``pending`` is a deque of folder IDs, or of entries that ``folder_of``
+    maps to folder IDs. At least one entry is taken if any are pending, and
+    at most ``max_folders`` if given.
+    """
+    group = []
+    length = len(extra) + len(" and ()")
+    while pending and (max_folders is None or len(group) < max_folders):
+        folder_id = pending[0] if folder_of is None else folder_of(pending[0])
+        clause = len(_clause(folder_id)) + len(" or ")
+        if group and length + clause > MAX_QUERY_LENGTH:
+            break
+        group.append(pending.popleft())
+        length += clause
+    return group
+
+def list_children(service, folder_ids, fields=TREE_FIELDS, page_token=None, extra=NOT_TRASHED,
+                  page_size=LIST_PAGE_SIZE):
+    """Fetch one page of the combined listing of ``folder_ids``.
+
+    Returns a dict mapping each requested folder ID to the items of this page
+    that sit directly in it, and the token of the next page or None.
+    """
+    response = execute(service.files().list(
+        q=parents_query(folder_ids, extra),
+        fields=fields,
+        pageSize=page_size,
+        pageToken=page_token
+    ))
+    children = {folder_id: [] for folder_id in folder_ids}
+    for item in response.get('files', []):
+        for parent_id in item.get('parents', ()):
+            if parent_id in children:
+                children[parent_id].append(item)
+                break
+    return children, response.get('nextPageToken', None)
+
+def iter_children(service, folder_ids, fields=TREE_FIELDS, extra=NOT_TRASHED):
+    """Yield (folder ID, item) for every child of ``folder_ids``, listing them in groups."""
+    pending = deque(folder_ids)
+    while pending:
+        group = take_group(pending, extra=extra)
+        page_token = None
+        while True:
+            children, page_token = list_children(service, group, fields, page_token, extra)
+            for folder_id in group:
+                for item in children[folder_id]:
+                    yield folder_id, item
+            if not page_token:
+                break
+
+class FolderListings:
+    """Cached child listings of folder hierarchies, with recursive file counts.
+
+    ``walk`` lists every folder below some roots level by level, through
+    combined parents queries, and keeps each folder's children, so a tree
+    view can show counts straight away and render any folder later without
+    another request, and a migration can be planned from the same listings
+    (see ``manifest``). Folders outside a walk are listed on first use.
+    Safe to share between threads; no lock is held while listing.
+    """
+
+    def __init__(self, fields=BROWSE_FIELDS):
+        self.fields = fields
+        self._children = {}
+        self._counts = {}
+        # Walked folder ID -> time.monotonic() of the walk that listed it
+        self._walked_at = {}
+        # Bumped by clear, so a walk that was running across it is not trusted for a manifest
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def walk(self, service, folder_ids):
+        """List every folder below ``folder_ids`` not walked yet and count their files."""
+        with self._lock:
+            generation = self._generation
+            walked_before = set(self._walked_at)
+        # Folders only listed by ``children`` are listed again, as their subfolders were not
+        level = [folder_id for folder_id in folder_ids if folder_id not in walked_before]
+        children = {}
+        walked = []
+        while level:
+            for folder_id in level:
+                children[folder_id] = []
+            walked.extend(level)
+            next_level = []
+            for folder_id, item in iter_children(service, level, self.fields):
+                children[folder_id].append(item)
+                if item['mimeType'] == FOLDER_MIME and item['id'] not in walked_before:
+                    next_level.append(item['id'])
+            level = next_level
+        with self._lock:
+            self._children.update(children)
+            if generation == self._generation:
+                walked_at = time.monotonic()
+                for folder_id in walked:
+                    self._walked_at[folder_id] = walked_at
+            # Subfolders were listed after their parents, so count deepest first
+            for folder_id in reversed(walked):
+                self._counts[folder_id] = sum(self._counts.get(item['id'], 0) if item['mimeType'] == FOLDER_MIME
+                                              else 1 for item in self._children[folder_id])
+
+    def cached_children(self, folder_id):
+        """Return the cached children of a folder, or None if it was never listed."""
+        with self._lock:
+            return self._children.get(folder_id)
+
+    def children(self, service, folder_id):
+        """Return the children of a folder, listing it only if it is not cached."""
+        with self._lock:
+            cached = self._children.get(folder_id)
+        if cached is not None:
+            return cached
+        items = [item for _, item in iter_children(service, [folder_id], self.fields)]
+        with self._lock:
+            return self._children.setdefault(folder_id, items)
+
+    def file_count(self, folder_id):
+        """Return the number of files anywhere below a walked folder, or None if it was not walked."""
+        with self._lock:
+            return self._counts.get(folder_id)
+
+    def manifest(self, folder_ids, destination_id, max_age=None):
+        """Return the migration manifest of walked folders from the cached listings, without a request.
+
+        The moves are those migrate.plan_migration would list. Returns None if
+        any folder involved was not walked, or was walked more than
+        ``max_age`` seconds ago, so the caller can plan afresh instead.
+        """
+        now = time.monotonic()
+        manifest = []
+        level = list(folder_ids)
+        seen = set(folder_ids)
+        with self._lock:
+            while level:
+                next_level = []
+                for folder_id in level:
+                    walked_at = self._walked_at.get(folder_id)
+                    if walked_at is None or (max_age is not None and now - walked_at > max_age):
+                        return None
+                    for item in self._children[folder_id]:
+                        if item['mimeType'] == FOLDER_MIME:
+                            if item['id'] != destination_id and item['id'] not in seen:
+                                seen.add(item['id'])
+                                next_level.append(item['id'])
+                        else:
+                            manifest.append((item['id'], folder_id, destination_id))
+                level = next_level
+        return manifest
+
+    def clear(self):
+        """Forget every listing, e.g. once files have been moved."""
+        with self._lock:
+            self._children.clear()
+            self._counts.clear()
+            self._walked_at.clear()
+            self._generation += 1
@@ -0,0 +1,241 @@
+"""Optional run metrics: Drive calls, SQLite flushes, throughput and crawl progress.
+
+Metrics are off by default. The hooks in the scheduler, the writers, the
+crawl loop and the mover call ``count``, ``observe`` and ``gauge``, and
+those return straight away while no registry is installed. ``enable()``
+installs a Metrics registry for the process. ``summary()`` then gives a
+JSON-ready snapshot for the end of a run, and ``write_prometheus`` a
+node_exporter textfile.
+
+Recorded series (labels in braces):
+
+- ``drive_requests_total{method, outcome}`` and ``drive_request_seconds{method}``,
+  one per attempt, with outcome ``ok``, ``throttled`` or ``error``
+- ``drive_retries_total{method}`` and ``drive_throttles_total``
+- ``sqlite_flush_seconds{store}`` and ``sqlite_rows_total{store}``
+- ``items_total{kind}``: files stored or removed (``file``), moves finished (``move``)
+- ``folders_listed_total`` and ``crawl_frontier``: folders listed so far and waiting
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Seconds between rewrites of the Prometheus textfile while a run is going
+EXPORT_INTERVAL = 15.0
+
+# Prefix of every exported Prometheus metric name
+PROMETHEUS_PREFIX = 'drivecrawler_'
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+def _series(name, labels, quote=False):
+    """Return ``name{label=value,...}``, with Prometheus quoting if ``quote``."""
+    if not labels:
+        return name
+    if quote:
+        pairs = (f'{label}="{_escape(value)}"' for label, value in labels)
+    else:
+        pairs = (f"{label}={value}" for label, value in labels)
+    return f"{name}{{{','.join(pairs)}}}"
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum and maximum."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the ``q`` quantile by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for n, in_bucket in enumerate(self.counts):
+            if in_bucket and seen + in_bucket >= rank:
+                low = self.buckets[n - 1] if n else 0.0
+                high = self.buckets[n] if n < len(self.buckets) else self.max
+                return round(min(self.max, low + (high - low) * (rank - seen) / in_bucket), 6)
+            seen += in_bucket
+        return round(self.max, 6)
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'mean': round(self.sum / self.count, 6) if self.count else None,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                'max': round(self.max, 6)}
+
+class Metrics:
+    """Thread-safe registry of counters, histograms and gauges for one run."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._export_stop = None
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def eta(self):
+        """Seconds until the crawl frontier empties at the listing rate so far, or None."""
+        with self._lock:
+            frontier = self.gauges.get(('crawl_frontier', ()))
+            listed = self.counters.get(('folders_listed_total', ()), 0)
+        if frontier is None or not listed:
+            return None
+        return frontier / (listed / self.elapsed())
+
+    def summary(self):
+        """Return every series as a JSON-ready dict, with items/sec per kind and the crawl ETA."""
+        elapsed = self.elapsed()
+        with self._lock:
+            counters = {_series(name, labels): value for (name, labels), value in sorted(self.counters.items())}
+            histograms = {_series(name, labels): histogram.summary()
+                          for (name, labels), histogram in sorted(self.histograms.items())}
+            gauges = {_series(name, labels): value for (name, labels), value in sorted(self.gauges.items())}
+            rates = {_series('items_per_second', labels): round(value / elapsed, 1)
+                     for (name, labels), value in sorted(self.counters.items()) if name == 'items_total'}
+        eta = self.eta()
+        return {'elapsed_seconds': round(elapsed, 3), 'counters': counters, 'histograms': histograms,
+                'gauges': gauges, 'rates': rates, 'eta_seconds': round(eta, 1) if eta is not None else None}
+
+    def prometheus_text(self):
+        """Return the registry in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {kind}")
+                    lines.append(f"{_series(PROMETHEUS_PREFIX + name, labels, quote=True)} {value}")
+            typed = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} histogram")
+                cumulative = 0
+                bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+                for bound, in_bucket in zip(bounds, histogram.counts):
+                    cumulative += in_bucket
+                    lines.append(f"{_series(PROMETHEUS_PREFIX + name + '_bucket', labels + (('le', bound),), True)} "
+                                 f"{cumulative}")
+                lines.append(f"{_series(PROMETHEUS_PREFIX + name + '_sum', labels, True)} {histogram.sum}")
+                lines.append(f"{_series(PROMETHEUS_PREFIX + name + '_count', labels, True)} {histogram.count}")
+        eta = self.eta()
+        if eta is not None:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}crawl_eta_seconds gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}crawl_eta_seconds {eta:.1f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the textfile atomically, so a collector never reads half of it."""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+    def state(self):
+        """Return the counters and histograms as plain data, for ``merge`` in another process."""
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {key: (list(histogram.counts), histogram.count, histogram.sum, histogram.max)
+                                   for key, histogram in self.histograms.items()}}
+
+    def merge(self, state):
+        """Add the counters and histograms of another registry's ``state``."""
+        with self._lock:
+            for key, value in state['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (counts, count, total, peak) in state['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.counts = [mine + theirs for mine, theirs in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+                histogram.max = max(histogram.max, peak)
+
+    def start_export(self, path, interval=EXPORT_INTERVAL):
+        """Rewrite the Prometheus textfile every ``interval`` seconds until ``stop_export``."""
+        self._export_stop = threading.Event()
+
+        def run(stop=self._export_stop):
+            while not stop.wait(interval):
+                self.write_prometheus(path)
+        threading.Thread(target=run, name="MetricsExport", daemon=True).start()
+
+    def stop_export(self):
+        if self._export_stop is not None:
+            self._export_stop.set()
+            self._export_stop = None
+
+# Registry of the running process, or None while metrics are off; replace with enable()
+registry = None
+
+def enable():
+    """Start collecting metrics in a fresh registry and return it."""
+    global registry
+    registry = Metrics()
+    return registry
+
+def disable():
+    global registry
+    if registry is not None:
+        registry.stop_export()
+    registry = None
+
+def count(name, value=1, **labels):
+    if registry is not None:
+        registry.count(name, value, **labels)
+
+def observe(name, value, **labels):
+    if registry is not None:
+        registry.observe(name, value, **labels)
+
+def gauge(name, value, **labels):
+    if registry is not None:
+        registry.gauge(name, value, **labels)
+
+def request_method(request):
+    """Return the Drive method of a request, e.g. ``files.list``; batches are ``batch``."""
+    method_id = getattr(request, 'methodId', None)
+    return method_id.split('.', 1)[1] if method_id else 'batch'
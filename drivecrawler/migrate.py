@@ -0,0 +1,235 @@
+"""Planning and executing file migrations between Drive folders."""
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from drivecrawler import metrics
+from drivecrawler.crawl import FOLDER_MIME
+from drivecrawler.events import emit
+from drivecrawler.listing import PLAN_FIELDS, iter_children
+from drivecrawler.scheduler import execute, note_error
+from drivecrawler.service import worker_service
+
+logger = logging.getLogger(__name__)
+
+# Moves sent per Drive batch request (the API allows at most 100) and batches in flight at once
+MOVE_BATCH_SIZE = 100
+MOVE_CONCURRENCY = 4
+
+# Move results recorded in the manifest per commit
+MANIFEST_COMMIT_SIZE = 500
+
+# Migration manifests are kept at the top of the repository for auditing
+MANIFEST_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "migration.db")
+
+def _move_request(service, move):
+    file_id, source_id, destination_id = move
+    return service.files().update(fileId=file_id, addParents=destination_id,
+                                  removeParents=source_id, fields='id, parents')
+
+def _execute_moves(service_factory, moves):
+    """Send up to MOVE_BATCH_SIZE (file, source, destination) moves as one batch request.
+
+    Moves that fail inside the batch with a retryable error are retried one by
+    one through the scheduler, which backs off as needed. Returns a list of
+    (move, error) pairs for moves that still failed.
+    """
+    service = worker_service(service_factory)
+    failed = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            failed[int(request_id)] = exception
+
+    batch = service.new_batch_http_request(callback=callback)
+    for i, move in enumerate(moves):
+        batch.add(_move_request(service, move), request_id=str(i))
+    try:
+        execute(batch, cost=len(moves))
+    except Exception as e:
+        logger.warning("Batch of %d moves failed: %s", len(moves), e)
+        failed = {i: e for i in range(len(moves))}
+
+    failures = []
+    for i, error in sorted(failed.items()):
+        if note_error(error):
+            try:
+                execute(_move_request(service, moves[i]))
+                continue
+            except Exception as e:
+                error = e
+        logger.error("Failed to move %s: %s", moves[i][0], error)
+        failures.append((moves[i], error))
+    return failures
+
+def run_moves(service_factory, moves, on_moved, batch_size=MOVE_BATCH_SIZE, concurrency=MOVE_CONCURRENCY):
+    """Execute (file, source, destination) moves as batch requests, several batches at a time.
+
+    ``moves`` may be any iterable and is consumed lazily. ``on_moved`` is
+    called from the calling thread once per file with the move and the error
+    it finally failed with, or None. Returns the list of failed moves.
+    """
+    moves = iter(moves)
+    failures = []
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            while len(in_flight) < concurrency:
+                batch = [move for _, move in zip(range(batch_size), moves)]
+                if not batch:
+                    break
+                in_flight[pool.submit(_execute_moves, service_factory, batch)] = batch
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                errors = dict(future.result())
+                metrics.count('items_total', len(batch), kind='move')
+                for move in batch:
+                    error = errors.get(move)
+                    if error is not None:
+                        failures.append(move)
+                    on_moved(move, error)
+    return failures
+
+def plan_migration(service, folder_ids, destination_id):
+    """Walk the selected folders once and return the migration manifest.
+
+    The manifest is a list of (file ID, source parent ID, destination ID)
+    moves covering every file in the folders and all their subfolders. The
+    walk is breadth-first, listing each level's folders together, and does
+    no widget work; the destination folder is never descended into, in case
+    it sits inside a selected folder.
+    """
+    manifest = []
+    level = list(folder_ids)
+    seen = set(folder_ids)
+    while level:
+        # Every folder of a level is listed through as few combined queries as fit
+        next_level = []
+        for folder_id, item in iter_children(service, level, PLAN_FIELDS):
+            if item['mimeType'] == FOLDER_MIME:
+                if item['id'] != destination_id and item['id'] not in seen:
+                    seen.add(item['id'])
+                    next_level.append(item['id'])
+            else:
+                manifest.append((item['id'], folder_id, destination_id))
+        level = next_level
+    return manifest
+
+def _open_manifest(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS manifest (
+                        file_id TEXT PRIMARY KEY,
+                        source_id TEXT,
+                        destination_id TEXT,
+                        status TEXT DEFAULT 'pending')''')
+    if 'status' not in [row[1] for row in conn.execute("PRAGMA table_info(manifest)")]:
+        # Manifests saved before moves were tracked
+        conn.execute("ALTER TABLE manifest ADD COLUMN status TEXT DEFAULT 'pending'")
+    return conn
+
+def save_manifest(manifest, db_path=MANIFEST_DB):
+    """Persist a migration manifest to SQLite, replacing any earlier one."""
+    conn = _open_manifest(db_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM manifest")
+            conn.executemany("INSERT OR REPLACE INTO manifest (file_id, source_id, destination_id, status) "
+                             "VALUES (?, ?, ?, 'pending')", manifest)
+    finally:
+        conn.close()
+
+def load_manifest(db_path=MANIFEST_DB):
+    """Return the moves of a saved manifest that are not done yet, failed ones included."""
+    conn = _open_manifest(db_path)
+    try:
+        return conn.execute("SELECT file_id, source_id, destination_id FROM manifest "
+                            "WHERE status != 'done' ORDER BY rowid").fetchall()
+    finally:
+        conn.close()
+
+class ManifestProgress:
+    """Records the outcome of every move in the manifest, committing every ``batch_size`` moves.
+
+    An interrupted migration therefore loses at most one batch of progress,
+    and those moves are simply repeated on resume.
+    """
+
+    def __init__(self, db_path=MANIFEST_DB, batch_size=MANIFEST_COMMIT_SIZE):
+        self.batch_size = batch_size
+        self.flush_seconds = 0.0
+        self._conn = _open_manifest(db_path)
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(self, move, error):
+        """Buffer the result of one move."""
+        self._buffer.append(('done' if error is None else 'failed', move[0]))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Commit the buffered results."""
+        started = time.perf_counter()
+        with self._conn:
+            self._conn.executemany("UPDATE manifest SET status = ? WHERE file_id = ?", self._buffer)
+        seconds = time.perf_counter() - started
+        self.flush_seconds += seconds
+        metrics.observe('sqlite_flush_seconds', seconds, store='manifest')
+        metrics.count('sqlite_rows_total', len(self._buffer), store='manifest')
+        self._buffer = []
+
+    def close(self):
+        """Commit what is left and close the manifest."""
+        self.flush()
+        self._conn.close()
+
+def migrate(service_factory, folder_ids, destination_id, on_event=None, manifest_db=MANIFEST_DB, resume=False,
+            manifest=None):
+    """Move every file below ``folder_ids`` into ``destination_id``.
+
+    Plans the migration in one pass, saves the manifest to ``manifest_db``
+    (unless it is None) and runs the moves, recording each file's outcome in
+    the manifest. A ``manifest`` already built from listings the caller
+    holds (see listing.FolderListings.manifest) is used instead of planning.
+    With ``resume`` set, the saved manifest's pending and failed moves are
+    run instead, without listing anything. Emits
+    ``planned``, ``moved`` and ``done`` events to ``on_event`` and returns a
+    dict with the total number of files moved in this run and the number that
+    failed.
+    """
+    if resume:
+        manifest = load_manifest(manifest_db)
+    else:
+        if manifest is None:
+            manifest = plan_migration(worker_service(service_factory), folder_ids, destination_id)
+        if manifest_db:
+            save_manifest(manifest, manifest_db)
+    emit(on_event, 'planned', total=len(manifest))
+
+    progress = ManifestProgress(manifest_db) if manifest_db else None
+
+    def on_moved(move, error):
+        if progress is not None:
+            progress.record(move, error)
+        emit(on_event, 'moved', move=move, error=error)
+
+    try:
+        failures = run_moves(service_factory, manifest, on_moved)
+    finally:
+        if progress is not None:
+            progress.close()
+    result = {'total': len(manifest), 'failed': len(failures)}
+    emit(on_event, 'done', result=result)
+    return result
@@ -0,0 +1,160 @@
+"""Read-side queries over documents.db for browsing without loading the table."""
+import re
+import sqlite3
+import string
+from concurrent.futures import ThreadPoolExecutor
+
+from drivecrawler.db import DB_PATH
+
+# Rows per page shown by DocumentPager
+PAGE_SIZE = 200
+
+# Sortable columns and the collation their index was built with
+SORT_COLUMNS = {'name': 'NOCASE', 'doc_index': 'BINARY', 'folder': 'NOCASE'}
+
+# Default number of results returned by search_documents
+SEARCH_LIMIT = 50
+
+# SQLite's NOCASE collation folds ASCII letters only
+NOCASE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query where every word must match as a prefix."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+def search_documents(text, limit=SEARCH_LIMIT, db_path=DB_PATH):
+    """Find documents by words or word prefixes of their name, index and folder.
+
+    Every word of ``text`` must match, so ``cks 2691`` finds CKS 26917738
+    and ``hongera mp2`` narrows to the MP2 folders. Results are ranked by
+    bm25 and returned as dicts with name, doc_index, folder, url and rank
+    (lower ranks are better).
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+    conn = sqlite3.connect(db_path)
+    try:
+        try:
+            rows = conn.execute('''SELECT d.name, d.doc_index, d.folder, d.url, bm25(documents_fts) AS rank
+                                   FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+                                   WHERE documents_fts MATCH ?
+                                   ORDER BY rank LIMIT ?''', (query, limit)).fetchall()
+        except sqlite3.OperationalError:
+            # No FTS5 in this SQLite build: match every word as a substring instead
+            words = re.findall(r"\w+", text)
+            where = " AND ".join("(name LIKE ? OR doc_index LIKE ? OR folder LIKE ?)" for _ in words)
+            params = [f"%{word}%" for word in words for _ in range(3)]
+            rows = conn.execute(f"SELECT name, doc_index, folder, url, 0 FROM documents WHERE {where} LIMIT ?",
+                                params + [limit]).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(('name', 'doc_index', 'folder', 'url', 'rank'), row)) for row in rows]
+
+def _prefix_bounds(prefix):
+    """Return the half-open range of strings starting with ``prefix``."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+class DocumentPager:
+    """Keyset-paginated, sorted and prefix-filtered view of the documents table.
+
+    Pages are fetched by seeking past the (sort key, id) of the last row seen
+    rather than with OFFSET, so every page costs one index range scan however deep the
+    reader is, and nothing beyond the current page is held in memory. A
+    search matches the start of the name, index or folder through the
+    indexes from init_db. All queries run on one background thread, which
+    prefetches the following page as soon as a page is returned.
+    """
+
+    def __init__(self, db_path=DB_PATH, page_size=PAGE_SIZE):
+        self.db_path = db_path
+        self.page_size = page_size
+        self.page_number = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._conn = None
+        self._prefetch = None
+        self.set_query()
+
+    def set_query(self, sort='name', descending=False, search=''):
+        """Change the sort order or search and return the first page."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort!r}")
+        self.sort = sort
+        self.descending = descending
+        self.search = search.strip()
+        self._first_key = self._last_key = None
+        self._prefetch = None
+        self.page_number = 0
+        return self.next_page()
+
+    def _where(self, key, forward):
+        """Build the WHERE clause and parameters for the page after or before ``key``."""
+        clauses, params = [], []
+        collate = SORT_COLUMNS[self.sort]
+        if self.search:
+            # Bounds for the NOCASE columns are taken from the folded term, since
+            # NOCASE compares lowercase and ``Z`` + 1 would sort before ``a``
+            low, high = _prefix_bounds(self.search.translate(NOCASE_FOLD))
+            index_low, index_high = _prefix_bounds(self.search)
+            clauses.append("((name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE)"
+                           " OR (doc_index >= ? AND doc_index < ?)"
+                           " OR (folder >= ? COLLATE NOCASE AND folder < ? COLLATE NOCASE))")
+            params += [low, high, index_low, index_high, low, high]
+        if key is not None:
+            # Spelled out rather than as a row value so SQLite can seek the index to the key
+            op = '>' if forward != self.descending else '<'
+            clauses.append(f"{self.sort} {op}= ? COLLATE {collate}"
+                           f" AND ({self.sort} {op} ? COLLATE {collate} OR id {op} ?)")
+            params += [key[0], key[0], key[1]]
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, key, forward):
+        """Runs on the pager thread: fetch the page after (or before) ``key``."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        where, params = self._where(key, forward)
+        ascending = forward != self.descending
+        direction = "ASC" if ascending else "DESC"
+        rows = self._conn.execute(
+            f"SELECT id, {self.sort}, name, doc_index, folder, url FROM documents{where}"
+            f" ORDER BY {self.sort} COLLATE {SORT_COLUMNS[self.sort]} {direction}, id {direction} LIMIT ?",
+            params + [self.page_size]).fetchall()
+        return rows if forward else rows[::-1]
+
+    def _show(self, rows):
+        self._first_key = (rows[0][1], rows[0][0])
+        self._last_key = (rows[-1][1], rows[-1][0])
+        self._prefetch = self._executor.submit(self._query, self._last_key, True)
+        return [row[2:] for row in rows]
+
+    def next_page(self):
+        """Return the next page of (name, index, folder, url) rows, or [] at the end."""
+        if self._prefetch is not None:
+            rows = self._prefetch.result()
+        else:
+            rows = self._executor.submit(self._query, self._last_key, True).result()
+        if not rows:
+            self._prefetch = None
+            return []
+        self.page_number += 1
+        return self._show(rows)
+
+    def previous_page(self):
+        """Return the previous page of rows, or [] when already on the first page."""
+        if self.page_number <= 1:
+            return []
+        rows = self._executor.submit(self._query, self._first_key, False).result()
+        if not rows:
+            # The rows before this page were deleted meanwhile, e.g. by a running sync
+            return []
+        self.page_number -= 1
+        return self._show(rows)
+
+    def close(self):
+        """Close the database connection and stop the pager thread."""
+        def close_connection():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(close_connection).result()
+        self._executor.shutdown()
@@ -0,0 +1,221 @@
+"""Quota-aware execution of Drive API requests.
+
+Every Drive call made by the crawler and the mover goes through ``execute``,
+which draws from one shared token bucket, limits how many requests are in
+flight, and retries rate-limit (403/429), 5xx and transport errors with
+exponential backoff and jitter. Throttling halves the concurrency limit and
+slows the bucket; sustained success grows them back, so long runs settle at
+the highest rate Drive will sustain.
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from drivecrawler import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests per second and burst size of the shared token bucket
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 40
+# Upper bound on concurrent requests; the adaptive limit starts here
+DEFAULT_CONCURRENCY = 16
+# Retry policy for throttled and failed requests
+MAX_RETRIES = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 64.0
+# Successful requests needed before the concurrency limit and rate grow again
+RECOVERY_INTERVAL = 50
+# Throttles closer together than this count as one, so a burst of 429s cuts the limits once
+THROTTLE_COOLDOWN = 1.0
+
+RATE_LIMIT_REASONS = {'userRateLimitExceeded', 'rateLimitExceeded', 'sharingRateLimitExceeded'}
+
+def _error_reasons(error):
+    """Return the reason codes of a Drive HttpError."""
+    try:
+        details = json.loads(error.content.decode('utf-8'))['error']
+    except (AttributeError, ValueError, KeyError, TypeError):
+        return set()
+    return {item.get('reason') for item in details.get('errors', [])}
+
+def is_rate_limited(error):
+    """True if a Drive error means the caller is being throttled."""
+    status = getattr(error.resp, 'status', None)
+    return status == 429 or (status == 403 and bool(_error_reasons(error) & RATE_LIMIT_REASONS))
+
+def is_retryable(error):
+    """True if a failed request is worth retrying."""
+    if isinstance(error, HttpError):
+        return is_rate_limited(error) or getattr(error.resp, 'status', 0) >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+class RequestScheduler:
+    """Token bucket, adaptive concurrency limit and retry policy for Drive calls.
+
+    One instance is shared by all threads of a run. ``rate`` is the sustained
+    requests per second and ``burst`` the bucket size; ``max_concurrency``
+    caps requests in flight. Both the rate and the concurrency limit are cut
+    when Drive throttles and recover after ``RECOVERY_INTERVAL`` successes.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._successes = 0
+        self._last_cut = float('-inf')
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+
+    def _take_tokens(self, cost):
+        """Block until ``cost`` tokens are available and take them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                # Batches may cost more than the bucket holds; let them drain it
+                needed = min(cost, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= cost
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _acquire_slot(self):
+        with self._slot_free:
+            while self._active >= self.concurrency:
+                self._slot_free.wait()
+            self._active += 1
+
+    def _release_slot(self):
+        with self._slot_free:
+            self._active -= 1
+            self._slot_free.notify()
+
+    def record_success(self):
+        """Count a successful call, growing the limits back after enough of them."""
+        with self._slot_free:
+            self.requests += 1
+            self._successes += 1
+            if self._successes >= RECOVERY_INTERVAL:
+                self._successes = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.rate = min(self.max_rate, self.rate * 1.1)
+                self._slot_free.notify_all()
+
+    def record_throttle(self):
+        """Back off after Drive reports a rate limit."""
+        with self._lock:
+            self.throttles += 1
+            self._successes = 0
+            metrics.count('drive_throttles_total')
+            now = time.monotonic()
+            if now - self._last_cut < THROTTLE_COOLDOWN:
+                return
+            self._last_cut = now
+            self.concurrency = max(1, self.concurrency // 2)
+            self.rate = max(self.max_rate / 20, self.rate / 2)
+
+    def backoff_delay(self, attempt, error=None):
+        """Seconds to wait before retry ``attempt``, honouring a Retry-After header."""
+        retry_after = None
+        if isinstance(error, HttpError):
+            retry_after = error.resp.get('retry-after') if hasattr(error.resp, 'get') else None
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter keeps parallel workers from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def note_error(self, error):
+        """Account for a failed call; returns True if it should be retried."""
+        if isinstance(error, HttpError) and is_rate_limited(error):
+            self.record_throttle()
+        return is_retryable(error)
+
+    def execute(self, request, cost=1):
+        """Execute a Drive request (or batch of ``cost`` requests) under the shared limits."""
+        # Looked up once so that disabled metrics cost a single check per attempt
+        registry = metrics.registry
+        method = metrics.request_method(request) if registry is not None else None
+        attempt = 0
+        while True:
+            self._take_tokens(cost)
+            self._acquire_slot()
+            started = time.perf_counter()
+            try:
+                response = request.execute()
+            except Exception as error:
+                if registry is not None:
+                    throttled = isinstance(error, HttpError) and is_rate_limited(error)
+                    registry.observe('drive_request_seconds', time.perf_counter() - started, method=method)
+                    registry.count('drive_requests_total', method=method,
+                                   outcome='throttled' if throttled else 'error')
+                if not self.note_error(error) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, error)
+                logger.warning("Drive request failed (%s), retry %d in %.1fs", error, attempt + 1, delay)
+                with self._lock:
+                    self.retries += 1
+                if registry is not None:
+                    registry.count('drive_retries_total', method=method)
+                attempt += 1
+            else:
+                if registry is not None:
+                    registry.observe('drive_request_seconds', time.perf_counter() - started, method=method)
+                    registry.count('drive_requests_total', method=method, outcome='ok')
+                self.record_success()
+                return response
+            finally:
+                self._release_slot()
+            time.sleep(delay)
+
+    def add_counts(self, stats):
+        """Add the request, retry and throttle counts of another scheduler's ``stats``."""
+        with self._lock:
+            self.requests += stats['requests']
+            self.retries += stats['retries']
+            self.throttles += stats['throttles']
+
+    def stats(self):
+        """Return request, retry and throttle counters and the current limits."""
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries, 'throttles': self.throttles,
+                    'concurrency': self.concurrency, 'rate': self.rate}
+
+# Shared by every Drive call in the process; replace with configure()
+scheduler = RequestScheduler()
+
+def configure(**options):
+    """Replace the shared scheduler, e.g. ``configure(rate=5, max_concurrency=4)``."""
+    global scheduler
+    scheduler = RequestScheduler(**options)
+    return scheduler
+
+def execute(request, cost=1):
+    """Execute a Drive request through the shared scheduler."""
+    return scheduler.execute(request, cost)
+
+def note_error(error):
+    """Report an error from inside a batch to the shared scheduler; True if retryable."""
+    return scheduler.note_error(error)
@@ -0,0 +1,151 @@
+"""Credentials and Drive service construction."""
+import datetime
+import json
+import os
+import threading
+
+import google_auth_httplib2
+import httplib2
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+# Google Drive API scopes: the crawler only reads, the mover also updates parents
+READONLY_SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+FULL_SCOPES = ['https://www.googleapis.com/auth/drive']
+
+# Refresh access tokens this long before they expire
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Socket timeout of every worker's HTTP connection, in seconds
+HTTP_TIMEOUT = 120
+
+# Fetched only if the installed client library does not bundle the document
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/drive/v3/rest'
+
+def authenticate(scopes, token_path='token.json', credentials_path='credentials.json', service_account_file=None):
+    """Authenticate with Google APIs.
+
+    Uses the service account key in ``service_account_file`` if given, which
+    needs no browser and suits headless hosts. Otherwise the user token in
+    ``token_path`` is loaded, refreshed or created through the OAuth flow.
+    """
+    if service_account_file:
+        return service_account.Credentials.from_service_account_file(service_account_file, scopes=scopes)
+    creds = None
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, scopes)
+            creds = flow.run_local_server(port=0)
+        with open(token_path, 'w') as token:
+            token.write(creds.to_json())
+    return creds
+
+def is_service_account_file(path):
+    """True if ``path`` holds a service account key rather than a user token."""
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        try:
+            return json.load(f).get('type') == 'service_account'
+        except ValueError:
+            return False
+
+_discovery = {}
+_discovery_lock = threading.Lock()
+
+def _discovery_document():
+    """Return the parsed Drive v3 discovery document, loaded once per process."""
+    with _discovery_lock:
+        if 'drive' not in _discovery:
+            document = get_static_doc('drive', 'v3')
+            if document is None:
+                _, document = httplib2.Http(timeout=HTTP_TIMEOUT).request(DISCOVERY_URL)
+            _discovery['drive'] = json.loads(document)
+        return _discovery['drive']
+
+class _PooledHttp(google_auth_httplib2.AuthorizedHttp):
+    """A worker's own connection, authorized with the pool's shared credentials."""
+
+    def __init__(self, pool):
+        super().__init__(pool.creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        self._pool = pool
+
+    def request(self, *args, **kwargs):
+        self._pool.ensure_fresh()
+        return super().request(*args, **kwargs)
+
+class ServicePool:
+    """Drive service factory sharing one set of credentials and one discovery document.
+
+    Calling the pool builds a service on a new httplib2 connection, which is
+    not thread-safe, so workers get theirs through ``worker_service`` and keep
+    it for every request they make. Services are built from a discovery
+    document parsed once per process. The shared credentials are refreshed
+    under a lock by the first request made within REFRESH_MARGIN of expiry,
+    so workers never race to refresh or send an expired token; a refreshed
+    user token is saved back to ``token_path``.
+    """
+
+    def __init__(self, creds, token_path=None):
+        self.creds = creds
+        self.token_path = token_path
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return build_from_document(_discovery_document(), http=_PooledHttp(self))
+
+    def _needs_refresh(self):
+        if not self.creds.token:
+            return True
+        expiry = self.creds.expiry
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return expiry is not None and expiry - REFRESH_MARGIN <= now
+
+    def ensure_fresh(self):
+        """Refresh the credentials if they are missing a token or about to expire."""
+        if not self._needs_refresh():
+            return
+        with self._lock:
+            # Another worker may have refreshed while we waited
+            if self._needs_refresh():
+                self.creds.refresh(Request())
+                if self.token_path:
+                    with open(self.token_path, 'w') as token:
+                        token.write(self.creds.to_json())
+
+def service_factory(creds, token_path=None):
+    """Return a ServicePool building Drive services from ``creds``."""
+    return ServicePool(creds, token_path)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def service_pool(scopes, token_path='token.json', credentials_path='credentials.json', service_account_file=None):
+    """Return the process-wide ServicePool for these credentials, authenticating only on first use."""
+    key = (tuple(scopes), token_path, credentials_path, service_account_file)
+    with _pools_lock:
+        if key not in _pools:
+            creds = authenticate(scopes, token_path, credentials_path, service_account_file)
+            _pools[key] = ServicePool(creds, None if service_account_file else token_path)
+        return _pools[key]
+
+_worker_state = threading.local()
+
+def worker_service(factory):
+    """Return the Drive service owned by the current worker thread."""
+    services = getattr(_worker_state, 'services', None)
+    if services is None:
+        services = _worker_state.services = {}
+    if factory not in services:
+        # httplib2 clients are not thread-safe, so every worker builds its own
+        services[factory] = factory()
+    return services[factory]
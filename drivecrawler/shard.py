@@ -0,0 +1,216 @@
+"""Crawling across several processes, each with its own Drive credentials.
+
+One user's quota and one Python process cap how fast ``crawl.crawl`` can
+go. ``sharded_crawl`` keeps the crawl frontier in the calling process and
+hands listings to worker processes, the shards. Each shard has its own
+credentials, its own scheduler and so its own quota. A shard is handed the
+next listing whenever one of its threads is free, so a shard that finishes
+early simply takes more of the remaining work and a slow or throttled one
+takes less. The listings of a shard that dies go back to the others.
+Results come back to the calling process, which is the single writer of
+documents.db and of the checkpoint.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+
+from drivecrawler import metrics, scheduler
+from drivecrawler.crawl import CRAWL_WORKERS, FolderCache, fetch_page, group_folders, next_listing, record_page
+from drivecrawler.events import emit
+
+logger = logging.getLogger(__name__)
+
+# Listing threads in each shard process
+SHARD_THREADS = CRAWL_WORKERS
+
+# Seconds to wait for a result before checking that the shards are still alive
+RESULT_POLL_INTERVAL = 1.0
+
+# Seconds given to shard processes to exit once the crawl is over
+SHARD_EXIT_TIMEOUT = 10.0
+
+# Tags of the results that are not listings: a shard that could not start,
+# and the final report of a shard's scheduler counts and metrics
+_FAILED = 'failed'
+_REPORT = 'report'
+
+class ShardError(Exception):
+    """A shard failed to start, or a listing failed inside a shard."""
+
+def _shard_worker(shard_id, make_factory, tasks, results, threads, scheduler_options, collect_metrics):
+    """Body of a shard process: list the folders of every task taken off ``tasks``.
+
+    Once told to stop, the shard reports its scheduler counts and, with
+    ``collect_metrics``, the state of its metrics registry.
+    """
+    if scheduler_options:
+        scheduler.configure(**scheduler_options)
+    registry = metrics.enable() if collect_metrics else None
+    try:
+        factory = make_factory()
+    except Exception as error:
+        results.put((_FAILED, shard_id, None, f"{type(error).__name__}: {error}"))
+        return
+    folder_cache = FolderCache()
+
+    def run():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            task_id, folder_ids, names, page_token = task
+            # Names of folders found by any shard, so files are labelled without a files().get
+            for folder_id, name in names.items():
+                folder_cache.put(folder_id, name)
+            try:
+                children, page_token = fetch_page(factory, folder_cache, folder_ids, page_token)
+            except Exception as error:
+                results.put((task_id, shard_id, None, f"{type(error).__name__}: {error}"))
+            else:
+                results.put((task_id, shard_id, (children, page_token), None))
+
+    workers = [threading.Thread(target=run, name=f"Shard{shard_id}-{n}") for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((_REPORT, shard_id, {'scheduler': scheduler.scheduler.stats(),
+                                     'metrics': registry.state() if registry is not None else None}, None))
+
+def _collect_reports(results, processes, shard_ids):
+    """Merge the final reports of the given shards into this process's scheduler and metrics."""
+    deadline = time.monotonic() + SHARD_EXIT_TIMEOUT
+    while shard_ids and time.monotonic() < deadline:
+        try:
+            tag, shard_id, report, _ = results.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            shard_ids = {shard_id for shard_id in shard_ids if processes[shard_id].is_alive()}
+            continue
+        # Listings still arriving after a cancel or an error are dropped
+        if tag != _REPORT:
+            continue
+        shard_ids.discard(shard_id)
+        scheduler.scheduler.add_counts(report['scheduler'])
+        if report['metrics'] is not None and metrics.registry is not None:
+            metrics.registry.merge(report['metrics'])
+
+def sharded_crawl(shards, folder_ids, writer=None, on_event=None, threads=SHARD_THREADS, checkpoint=None,
+                  cancel=None, scheduler_options=None):
+    """Crawl the given folders in full across one process per shard.
+
+    ``shards`` is a list of picklable callables that return a Drive service
+    factory, for instance ``functools.partial(service_pool, scopes,
+    token_path)``, one per credential or service account. Each is called in
+    its own process, which lists folders with ``threads`` threads under its
+    own scheduler, configured with ``scheduler_options`` if given. Files are
+    stored through ``writer`` and reported as events exactly like
+    crawl.crawl, and a CrawlCheckpoint on the same writer makes the crawl
+    resumable. A shard that cannot start or dies is logged and its listings
+    go back to the others; ShardError is raised if none is left. At the end
+    the shards' request counts are added to the shared scheduler of this
+    process and, if metrics are enabled here, their metrics to its registry.
+    Returns a dict of file counts keyed by root folder ID.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    task_queues = [context.Queue() for _ in shards]
+    processes = [context.Process(target=_shard_worker, name=f"Shard{shard_id}", daemon=True,
+                                 args=(shard_id, make_factory, task_queues[shard_id], results, threads,
+                                       scheduler_options, metrics.registry is not None))
+                 for shard_id, make_factory in enumerate(shards)]
+    for process in processes:
+        process.start()
+
+    counts = {folder_id: 0 for folder_id in folder_ids}
+    if checkpoint is None:
+        pending = deque((folder_id, folder_id) for folder_id in folder_ids)
+        continued = deque()
+    else:
+        pending, continued = checkpoint.frontier(folder_ids)
+    # Names of folders found but not fully listed yet, passed along with their listings
+    names = {}
+    # task ID -> (group, page token, shard ID), and the task IDs each live shard holds
+    in_flight = {}
+    assigned = {shard_id: set() for shard_id in range(len(shards))}
+    next_task = 0
+
+    def on_file(item):
+        if writer is not None:
+            writer.write(item)
+        emit(on_event, 'file', root_id=item['rootId'], item=item)
+
+    def on_folder(item):
+        names[item['id']] = item['name']
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def drop_shard(shard_id, reason):
+        # Put the shard's unfinished listings back in front for the other shards
+        logger.error("Shard %d %s; moving its work to the other shards", shard_id, reason)
+        for task_id in assigned.pop(shard_id):
+            group, page_token, _ = in_flight.pop(task_id)
+            if page_token:
+                continued.appendleft((group, page_token))
+            else:
+                pending.extendleft(reversed(group))
+        if not assigned:
+            raise ShardError("no shard left to crawl with")
+
+    try:
+        while in_flight or ((pending or continued) and not cancelled()):
+            # Fill every shard up to one listing per thread, so a shard that has
+            # finished its listings gets the next ones
+            idle = sum(threads - len(tasks) for tasks in assigned.values())
+            for shard_id, tasks in assigned.items():
+                while (pending or continued) and len(tasks) < threads and not cancelled():
+                    group, page_token = next_listing(pending, continued, idle)
+                    folder_list = group_folders(group)
+                    task_queues[shard_id].put((next_task, folder_list, {folder_id: names[folder_id]
+                                                                        for folder_id in folder_list
+                                                                        if folder_id in names}, page_token))
+                    in_flight[next_task] = (group, page_token, shard_id)
+                    tasks.add(next_task)
+                    next_task += 1
+                    idle -= 1
+
+            try:
+                task_id, shard_id, page, error = results.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                for shard_id in [shard_id for shard_id in assigned if not processes[shard_id].is_alive()]:
+                    drop_shard(shard_id, f"exited with code {processes[shard_id].exitcode}")
+                continue
+
+            if task_id == _FAILED:
+                drop_shard(shard_id, f"failed to start: {error}")
+                continue
+            if task_id not in in_flight:
+                # Result of a shard already given up on
+                continue
+
+            group, _, _ = in_flight.pop(task_id)
+            assigned[shard_id].discard(task_id)
+            if error is not None:
+                for _, folder_id in group:
+                    emit(on_event, 'error', folder_id=folder_id, error=ShardError(error))
+                continue
+            children, page_token = page
+            record_page(group, children, page_token, pending, continued, counts, on_file, on_folder, checkpoint)
+            if not page_token:
+                for _, folder_id in group:
+                    names.pop(folder_id, None)
+    finally:
+        for task_queue in task_queues:
+            for _ in range(threads):
+                task_queue.put(None)
+        _collect_reports(results, processes, set(assigned))
+        for process in processes:
+            process.join(SHARD_EXIT_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+    emit(on_event, 'done', result=counts)
+    return counts
@@ -0,0 +1,334 @@
+"""In-process simulation of the Drive v3 API surface used by the crawler and the mover.
+
+``SimulatedDrive`` stands in for the service returned by ``build('drive',
+'v3')``: pass ``lambda: drive`` wherever a service factory is expected. It
+needs no network or credentials, so crawls, syncs and migrations can be run
+and measured offline (see ``drivecrawler.bench``).
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from drivecrawler.listing import FOLDER_MIME
+
+# ID of the folder every synthetic tree hangs from
+ROOT_ID = 'root'
+
+# Largest page files().list and changes().list will return
+MAX_PAGE_SIZE = 1000
+
+# Page size used when a list call does not ask for one
+DEFAULT_PAGE_SIZE = 100
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def _masked(item, fields):
+    """Return only the requested top-level fields of ``item`` (all of them if no mask is given)."""
+    if not fields:
+        return dict(item)
+    return {name: item[name] for name in fields if name in item}
+
+def _file_fields(fields):
+    """Return the field names inside ``files(...)`` of a list field mask, or None for all."""
+    match = re.search(r'files\(([^)]*)\)', fields or '')
+    return [name.strip() for name in match.group(1).split(',')] if match else None
+
+class _Request:
+    """Deferred call with the ``execute()`` interface of googleapiclient requests."""
+
+    def __init__(self, drive, method, run):
+        self.drive = drive
+        self.method = method
+        self.methodId = f"drive.{method}"
+        self.run = run
+
+    def execute(self, num_retries=0, http=None):
+        return self.drive._call(self.method, self.run)
+
+class _Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q=None, fields=None, pageSize=DEFAULT_PAGE_SIZE, pageToken=None, **kwargs):
+        return _Request(self.drive, 'files.list',
+                        lambda: self.drive._list(q or '', _file_fields(fields), pageSize, pageToken))
+
+    def get(self, fileId, fields=None, **kwargs):
+        names = [name.strip() for name in fields.split(',')] if fields else None
+        return _Request(self.drive, 'files.get', lambda: _masked(self.drive._get(fileId), names))
+
+    def update(self, fileId, addParents=None, removeParents=None, fields=None, body=None, **kwargs):
+        names = [name.strip() for name in fields.split(',')] if fields else None
+        return _Request(self.drive, 'files.update',
+                        lambda: _masked(self.drive._update(fileId, addParents, removeParents, body), names))
+
+class _Changes:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return _Request(self.drive, 'changes.getStartPageToken',
+                        lambda: {'startPageToken': str(len(self.drive._log))})
+
+    def list(self, pageToken, pageSize=DEFAULT_PAGE_SIZE, **kwargs):
+        return _Request(self.drive, 'changes.list', lambda: self.drive._changes(pageToken, pageSize))
+
+class _Batch:
+    """Batch request: one round trip, but every inner request is counted and may be throttled."""
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        def run():
+            for request_id, request, callback in self.requests:
+                try:
+                    response = self.drive._call(request.method, request.run, batched=True)
+                except HttpError as error:
+                    callback(request_id, None, error)
+                else:
+                    callback(request_id, response, None)
+        return self.drive._call('batch', run)
+
+class SimulatedDrive:
+    """Synthetic Drive holding a generated folder tree.
+
+    Below ``ROOT_ID`` every folder holds ``files`` PDF files named like the
+    real contracts (``CKS <n>-27072023.pdf``) and, down to ``depth`` levels,
+    ``fanout`` subfolders. The listing queries drivecrawler sends (OR'd
+    parents, the folder mimeType filter, ``trashed=false``) are honoured,
+    with field masks, pageSize and page tokens that are only accepted with
+    the query they came from; the changes feed records every mutation.
+
+    Every request sleeps ``latency`` seconds (one round trip per batch), and
+    a ``throttle_rate`` fraction of requests fail with a 429 rate limit error
+    carrying ``retry_after`` if given. ``calls`` counts requests per method
+    and ``peak_in_flight`` the most requests served at once. Safe to share
+    between threads.
+    """
+
+    def __init__(self, depth=3, fanout=5, files=20, latency=0.0, throttle_rate=0.0, retry_after=None, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.calls = {}
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._items = {}
+        self._children = {}
+        self._log = []
+        # Matches of the last listing query, reused while paging through it unless something changed
+        self._listed = (None, None, None)
+        self._next_id = 0
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._add(ROOT_ID, "My Drive", FOLDER_MIME, None)
+        self._generate(ROOT_ID, depth, fanout, files)
+
+    # -- Service surface --
+
+    def files(self):
+        return _Files(self)
+
+    def changes(self):
+        return _Changes(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    # -- Tree construction and mutation --
+
+    def _new_id(self, prefix):
+        self._next_id += 1
+        return f"{prefix}{self._next_id:08d}"
+
+    def _add(self, item_id, name, mime_type, parent_id, size=None):
+        item = {'id': item_id, 'name': name, 'mimeType': mime_type, 'parents': [parent_id] if parent_id else [],
+                'webViewLink': f"https://drive.google.com/file/d/{item_id}/view?usp=drivesdk",
+                'modifiedTime': _now(), 'trashed': False}
+        if size is not None:
+            item['size'] = str(size)
+        self._items[item_id] = item
+        if mime_type == FOLDER_MIME:
+            self._children.setdefault(item_id, [])
+        if parent_id:
+            self._children.setdefault(parent_id, []).append(item_id)
+        return item
+
+    def _generate(self, parent_id, depth, fanout, files):
+        level = [parent_id]
+        for remaining in range(depth, -1, -1):
+            next_level = []
+            for folder_id in level:
+                for _ in range(files):
+                    self.add_file(folder_id, log=False)
+                if remaining:
+                    for _ in range(fanout):
+                        next_level.append(self.add_folder(folder_id, log=False))
+            level = next_level
+
+    def add_folder(self, parent_id, name=None, log=True):
+        """Create a folder and return its ID."""
+        with self._lock:
+            folder_id = self._new_id('fo')
+            self._add(folder_id, name or f"Folder {folder_id[2:]}", FOLDER_MIME, parent_id)
+            if log:
+                self._log.append(folder_id)
+            return folder_id
+
+    def add_file(self, parent_id, name=None, log=True):
+        """Create a PDF file and return its ID."""
+        with self._lock:
+            file_id = self._new_id('fi')
+            index = self._random.randrange(1000000, 99999999)
+            self._add(file_id, name or f"CKS {index}-27072023.pdf", 'application/pdf', parent_id,
+                      size=self._random.randrange(50000, 2000000))
+            if log:
+                self._log.append(file_id)
+            return file_id
+
+    def rename(self, item_id, name):
+        """Rename a file or folder."""
+        with self._lock:
+            self._items[item_id].update(name=name, modifiedTime=_now())
+            self._log.append(item_id)
+
+    def trash(self, item_id):
+        """Move a file or folder to the trash."""
+        with self._lock:
+            self._items[item_id].update(trashed=True, modifiedTime=_now())
+            self._log.append(item_id)
+
+    def delete(self, item_id):
+        """Delete a file permanently (folders keep their children, as orphans)."""
+        with self._lock:
+            item = self._items.pop(item_id)
+            for parent_id in item['parents']:
+                self._children[parent_id].remove(item_id)
+            self._log.append(item_id)
+
+    def ids(self, folders=False):
+        """Return the IDs of every file, or every folder, excluding the root."""
+        with self._lock:
+            return [item_id for item_id, item in self._items.items()
+                    if (item['mimeType'] == FOLDER_MIME) == folders and item_id != ROOT_ID]
+
+    # -- Request handling --
+
+    def _throttle_error(self):
+        headers = {'status': '429'}
+        if self.retry_after is not None:
+            headers['retry-after'] = str(self.retry_after)
+        content = json.dumps({'error': {'code': 429, 'message': "Rate Limit Exceeded",
+                                        'errors': [{'reason': 'rateLimitExceeded'}]}}).encode('utf-8')
+        return HttpError(httplib2.Response(headers), content)
+
+    def _call(self, method, run, batched=False):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+            if not batched:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if not batched and self.latency:
+                time.sleep(self.latency)
+            if throttled:
+                raise self._throttle_error()
+            with self._lock:
+                return run()
+        finally:
+            if not batched:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def _list(self, query, fields, page_size, page_token):
+        cached_query, version, matches = self._listed
+        if cached_query != query or version != len(self._log):
+            matches = self._matches(query)
+            self._listed = (query, len(self._log), matches)
+
+        # Like Drive's, a page token is only valid with the query it was issued for
+        digest = f"{zlib.crc32(query.encode('utf-8')):08x}"
+        start = 0
+        if page_token:
+            offset, _, token_digest = page_token.partition(':')
+            if token_digest != digest:
+                raise HttpError(httplib2.Response({'status': '400'}), json.dumps(
+                    {'error': {'code': 400, 'message': f"Invalid Value: pageToken {page_token}"}}).encode())
+            start = int(offset)
+        end = start + min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        response = {'files': [_masked(item, fields) for item in matches[start:end]]}
+        if end < len(matches):
+            response['nextPageToken'] = f"{end}:{digest}"
+        return response
+
+    def _matches(self, query):
+        parent_ids = re.findall(r"'([^']+)' in parents", query)
+        folders_only = f"mimeType='{FOLDER_MIME}'" in query
+        skip_trashed = 'trashed=false' in query.replace(' ', '')
+        if parent_ids:
+            candidates = (item_id for parent_id in parent_ids for item_id in self._children.get(parent_id, ()))
+        else:
+            candidates = (item_id for item_id in self._items if item_id != ROOT_ID)
+        return [self._items[item_id] for item_id in candidates
+                if not (skip_trashed and self._items[item_id]['trashed'])
+                and not (folders_only and self._items[item_id]['mimeType'] != FOLDER_MIME)]
+
+    def _get(self, file_id):
+        if file_id not in self._items:
+            raise HttpError(httplib2.Response({'status': '404'}),
+                            json.dumps({'error': {'code': 404, 'message': f"File not found: {file_id}"}}).encode())
+        return self._items[file_id]
+
+    def _update(self, file_id, add_parents, remove_parents, body):
+        item = self._get(file_id)
+        removed = set(remove_parents.split(',')) if remove_parents else set()
+        for parent_id in removed & set(item['parents']):
+            self._children[parent_id].remove(file_id)
+        parents = [parent_id for parent_id in item['parents'] if parent_id not in removed]
+        for parent_id in (add_parents.split(',') if add_parents else []):
+            if parent_id not in parents:
+                parents.append(parent_id)
+                self._children.setdefault(parent_id, []).append(file_id)
+        item['parents'] = parents
+        if body:
+            item.update(body)
+        item['modifiedTime'] = _now()
+        self._log.append(file_id)
+        return item
+
+    def _changes(self, page_token, page_size):
+        start = int(page_token)
+        end = min(start + min(page_size, MAX_PAGE_SIZE), len(self._log))
+        changes = []
+        for file_id in self._log[start:end]:
+            item = self._items.get(file_id)
+            change = {'fileId': file_id, 'removed': item is None}
+            if item is not None:
+                change['file'] = dict(item)
+            changes.append(change)
+        response = {'changes': changes}
+        if end < len(self._log):
+            response['nextPageToken'] = str(end)
+        else:
+            response['newStartPageToken'] = str(end)
+        return response
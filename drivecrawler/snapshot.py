@@ -0,0 +1,203 @@
+"""Whole-drive snapshots from one flat listing instead of one listing per folder."""
+from array import array
+
+from drivecrawler import metrics
+from drivecrawler.crawl import FOLDER_MIME, extract_index, get_folder_name
+from drivecrawler.events import emit
+from drivecrawler.listing import CRAWL_FIELDS, LIST_PAGE_SIZE, TREE_FIELDS
+from drivecrawler.scheduler import execute
+
+def list_all(service, fields=TREE_FIELDS, page_size=LIST_PAGE_SIZE, cancel=None):
+    """Yield every non-trashed item visible to the user, one page at a time."""
+    page_token = None
+    while True:
+        if cancel is not None and cancel.is_set():
+            return
+        response = execute(service.files().list(
+            q="trashed=false",
+            fields=fields,
+            pageSize=page_size,
+            pageToken=page_token
+        ))
+        yield response.get('files', [])
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+class DriveTree:
+    """Folder hierarchy rebuilt in memory from a flat listing.
+
+    Items are numbered in listing order and everything else is kept in
+    parallel arrays indexed by that number: names, a folder flag, the
+    parent's number and, after ``build``, children in compressed-row form and
+    recursive file counts. Only ``index`` maps Drive IDs back to numbers.
+    Items whose parent was not listed (the top of My Drive, or shared items)
+    get parent -1 and are grouped under that parent's ID in ``unlisted``, so
+    My Drive's own ID still works as a root. File details
+    (link, modified time, size) are kept only when ``keep_details`` is set.
+    """
+
+    def __init__(self, keep_details=False):
+        self.keep_details = keep_details
+        self.index = {}
+        self.ids = []
+        self.names = []
+        self.is_folder = bytearray()
+        self.details = []
+        self._parent_ids = []
+        self.parents = None
+        self.child_start = None
+        self.children = None
+        self.file_counts = None
+        self.unlisted = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, item):
+        """Record one listed item; parents are resolved later by ``build``."""
+        self.index[item['id']] = len(self.ids)
+        self.ids.append(item['id'])
+        self.names.append(item['name'])
+        self.is_folder.append(item['mimeType'] == FOLDER_MIME)
+        # Drive has allowed a single parent per item since 2020
+        parents = item.get('parents')
+        self._parent_ids.append(parents[0] if parents else None)
+        if self.keep_details:
+            self.details.append((item.get('webViewLink'), item.get('modifiedTime'), item.get('size')))
+
+    def build(self):
+        """Resolve parent links, index children and compute recursive file counts."""
+        count = len(self.ids)
+        index = self.index
+        self.parents = array('l', (index.get(parent_id, -1) for parent_id in self._parent_ids))
+        for n, parent_id in enumerate(self._parent_ids):
+            if self.parents[n] < 0 and parent_id is not None:
+                self.unlisted.setdefault(parent_id, array('l')).append(n)
+        self._parent_ids = []
+
+        # Children of item n are children[child_start[n]:child_start[n + 1]]
+        self.child_start = array('l', [0]) * (count + 1)
+        for parent in self.parents:
+            if parent >= 0:
+                self.child_start[parent + 1] += 1
+        for n in range(count):
+            self.child_start[n + 1] += self.child_start[n]
+        fill = array('l', self.child_start)
+        self.children = array('l', [0]) * self.child_start[count]
+        for n, parent in enumerate(self.parents):
+            if parent >= 0:
+                self.children[fill[parent]] = n
+                fill[parent] += 1
+
+        # Add every folder's total to its parent, deepest folders first
+        self.file_counts = array('l', [0]) * count
+        for n in reversed(self._top_down_order()):
+            if not self.is_folder[n]:
+                self.file_counts[n] = 1
+            parent = self.parents[n]
+            if parent >= 0:
+                self.file_counts[parent] += self.file_counts[n]
+        return self
+
+    def _top_down_order(self, roots=None):
+        """Return item numbers ordered so every parent comes before its children."""
+        if roots is None:
+            roots = [n for n, parent in enumerate(self.parents) if parent < 0]
+        order = array('l', roots)
+        position = 0
+        while position < len(order):
+            n = order[position]
+            order.extend(self.children[self.child_start[n]:self.child_start[n + 1]])
+            position += 1
+        return order
+
+    def __contains__(self, folder_id):
+        return folder_id in self.index or folder_id in self.unlisted
+
+    def file_count(self, folder_id):
+        """Return the number of files anywhere below a folder."""
+        if folder_id in self.index:
+            return self.file_counts[self.index[folder_id]]
+        return sum(self.file_counts[n] for n in self.unlisted.get(folder_id, ()))
+
+    def folder_counts(self):
+        """Return recursive file counts of every folder, keyed by folder ID."""
+        return {self.ids[n]: self.file_counts[n] for n in range(len(self.ids)) if self.is_folder[n]}
+
+    def files_under(self, folder_id):
+        """Yield the numbers of every file anywhere below a folder."""
+        if folder_id in self.index:
+            order = self._top_down_order([self.index[folder_id]])[1:]
+        else:
+            order = self._top_down_order(self.unlisted.get(folder_id, ()))
+        for n in order:
+            if not self.is_folder[n]:
+                yield n
+
+    def item(self, n):
+        """Return item ``n`` as a Drive item dict, with details if they were kept."""
+        parent = self.parents[n]
+        item = {'id': self.ids[n], 'name': self.names[n],
+                'parents': [self.ids[parent]] if parent >= 0 else [],
+                'mimeType': FOLDER_MIME if self.is_folder[n] else None}
+        if self.keep_details:
+            item['webViewLink'], item['modifiedTime'], item['size'] = self.details[n]
+        return item
+
+def build_tree(service, keep_details=False, on_page=None, cancel=None):
+    """List the whole drive and return it as a built DriveTree.
+
+    ``on_page``, if given, is called with the number of items listed so far
+    after every page. Returns None if ``cancel`` was set before the listing
+    finished.
+    """
+    tree = DriveTree(keep_details)
+    fields = CRAWL_FIELDS if keep_details else TREE_FIELDS
+    for files in list_all(service, fields, cancel=cancel):
+        for item in files:
+            tree.add(item)
+        if on_page is not None:
+            on_page(len(tree))
+    if cancel is not None and cancel.is_set():
+        return None
+    return tree.build()
+
+def snapshot_crawl(service, folder_ids, writer=None, on_event=None, cancel=None):
+    """Crawl folders from a single whole-drive listing instead of per-folder listings.
+
+    Produces the same ``file`` and ``done`` events and writer records as
+    crawl.crawl, at the cost of listing everything the user can see. This
+    pays off on drives with many small folders. A root that is not in the
+    listing is reported as an ``error`` event. Returns a dict of file counts
+    keyed by root folder ID.
+    """
+    tree = build_tree(service, keep_details=True, cancel=cancel)
+    counts = {folder_id: 0 for folder_id in folder_ids}
+    if tree is None:
+        emit(on_event, 'done', result=counts)
+        return counts
+
+    for root_id in folder_ids:
+        if root_id not in tree:
+            emit(on_event, 'error', folder_id=root_id, error=KeyError(f"folder {root_id} not found in drive listing"))
+            continue
+        # A root outside the listing (My Drive itself) still needs a name for its top-level files
+        root_name = tree.names[tree.index[root_id]] if root_id in tree.index else get_folder_name(service, root_id)
+        for n in tree.files_under(root_id):
+            item = tree.item(n)
+            index = extract_index(item['name'])
+            item['docIndex'] = index if index is not None else "N/A"
+            parent = tree.parents[n]
+            if parent < 0:
+                item['parents'] = [root_id]
+            item['folderName'] = tree.names[parent] if parent >= 0 else root_name
+            item['rootId'] = root_id
+            if writer is not None:
+                writer.write(item)
+            emit(on_event, 'file', root_id=root_id, item=item)
+            counts[root_id] += 1
+        metrics.count('items_total', counts[root_id], kind='file')
+
+    emit(on_event, 'done', result=counts)
+    return counts
@@ -0,0 +1,338 @@
+"""Incremental sync of crawled folders from the Drive changes feed."""
+import sqlite3
+
+from googleapiclient.errors import HttpError
+
+from drivecrawler import metrics
+from drivecrawler.crawl import CRAWL_WORKERS, FOLDER_MIME, FolderCache, crawl_folders, extract_index
+from drivecrawler.db import DB_PATH
+from drivecrawler.events import emit
+from drivecrawler.scheduler import execute
+from drivecrawler.service import worker_service
+
+CHANGE_FIELDS = ("nextPageToken, newStartPageToken, "
+                 "changes(fileId, removed, file(id, name, mimeType, parents, trashed, webViewLink, modifiedTime, size))")
+
+# File IDs looked up per query, below SQLite's default limit of 999 parameters
+STORED_LOOKUP_SIZE = 900
+
+def _load_sync_state(db_path, root_id):
+    """Return the saved changes page token and folder tree for a synced root."""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT page_token FROM sync_state WHERE root_id = ?", (root_id,)).fetchone()
+        folders = {folder_id: (parent_id, name) for folder_id, parent_id, name in conn.execute(
+            "SELECT id, parent_id, name FROM synced_folders WHERE root_id = ?", (root_id,))}
+    finally:
+        conn.close()
+    return (row[0] if row else None), folders
+
+def _stored_parents(db_path, file_ids):
+    """Return the stored parent folder of each of ``file_ids`` that has a documents row."""
+    parents = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        for start in range(0, len(file_ids), STORED_LOOKUP_SIZE):
+            chunk = file_ids[start:start + STORED_LOOKUP_SIZE]
+            parents.update(conn.execute(
+                f"SELECT drive_id, parent_id FROM documents WHERE drive_id IN ({', '.join('?' * len(chunk))})",
+                chunk))
+    finally:
+        conn.close()
+    return parents
+
+def _stored_count(db_path, folder_ids):
+    """Return the number of documents rows stored directly in any of ``folder_ids``."""
+    count = 0
+    conn = sqlite3.connect(db_path)
+    try:
+        for start in range(0, len(folder_ids), STORED_LOOKUP_SIZE):
+            chunk = folder_ids[start:start + STORED_LOOKUP_SIZE]
+            count += conn.execute(
+                f"SELECT COUNT(*) FROM documents WHERE parent_id IN ({', '.join('?' * len(chunk))})",
+                chunk).fetchone()[0]
+    finally:
+        conn.close()
+    return count
+
+def _fetch_changes(service, page_token):
+    """Read the changes feed from ``page_token`` to the end.
+
+    Returns the latest change for every file ID, in feed order, and the token
+    to start from next time.
+    """
+    changes = {}
+    while True:
+        response = execute(service.changes().list(
+            pageToken=page_token,
+            pageSize=1000,
+            includeRemoved=True,
+            spaces='drive',
+            fields=CHANGE_FIELDS
+        ))
+        for change in response.get('changes', []):
+            if change.get('fileId'):
+                changes.pop(change['fileId'], None)
+                changes[change['fileId']] = change
+        if 'newStartPageToken' in response:
+            return list(changes.values()), response['newStartPageToken']
+        page_token = response['nextPageToken']
+
+class _SyncedTree:
+    """Known folder tree of one synced root, mirrored to the synced_folders table."""
+
+    def __init__(self, root_id, folders, writer, db_path):
+        self.root_id = root_id
+        self.folders = folders
+        self.writer = writer
+        self.db_path = db_path
+
+    def __contains__(self, folder_id):
+        return folder_id in self.folders
+
+    def name(self, folder_id):
+        return self.folders[folder_id][1]
+
+    def add(self, folder_id, parent_id, name):
+        self.folders[folder_id] = (parent_id, name)
+        self.writer.execute("INSERT OR REPLACE INTO synced_folders (root_id, id, parent_id, name) VALUES (?, ?, ?, ?)",
+                            (self.root_id, folder_id, parent_id, name))
+
+    def has_ancestor(self, folder_id, ancestors):
+        """Return whether a folder sits anywhere below one of ``ancestors``."""
+        seen = set()
+        parent_id = self.folders[folder_id][0]
+        while parent_id in self.folders and parent_id not in seen:
+            if parent_id in ancestors:
+                return True
+            seen.add(parent_id)
+            parent_id = self.folders[parent_id][0]
+        return False
+
+    def subtree(self, folder_ids):
+        """Return the given folders and every folder below them."""
+        children = {}
+        for child_id, (parent_id, _) in self.folders.items():
+            children.setdefault(parent_id, []).append(child_id)
+        found = []
+        stack = list(folder_ids)
+        while stack:
+            current = stack.pop()
+            found.append(current)
+            stack.extend(children.get(current, []))
+        return found
+
+    def remove(self, folder_id):
+        """Forget a folder and everything below it, deleting their documents.
+
+        Returns the number of documents deleted.
+        """
+        folder_ids = self.subtree([folder_id])
+        removed = _stored_count(self.db_path, folder_ids)
+        for current in folder_ids:
+            self.folders.pop(current, None)
+            self.writer.execute("DELETE FROM synced_folders WHERE root_id = ? AND id = ?", (self.root_id, current))
+            self.writer.execute("DELETE FROM documents WHERE parent_id = ?", (current,))
+        return removed
+
+def _crawl_into_tree(service_factory, tree, folder_ids, writer, on_file, on_error, max_workers, folder_cache,
+                     cancel):
+    """Crawl folders below a synced tree, storing their files and subfolders.
+
+    Returns the number of files stored and the number of folders that failed,
+    which is non-zero if the crawl was cancelled.
+    """
+    failed = []
+
+    def on_folder(item):
+        tree.add(item['id'], item['parents'][0], item['name'])
+
+    def store(item):
+        writer.write(item)
+        if on_file is not None:
+            on_file(item)
+
+    def on_fetch_error(folder_id, error):
+        failed.append(folder_id)
+        if on_error is not None:
+            on_error(folder_id, error)
+
+    counts = crawl_folders(service_factory, folder_ids, store, max_workers, folder_cache,
+                           on_folder=on_folder, on_error=on_fetch_error, cancel=cancel)
+    if cancel is not None and cancel.is_set():
+        failed.append(None)
+    return sum(counts.values()), len(failed)
+
+def sync_folder(service_factory, root_id, writer, on_file=None, db_path=DB_PATH,
+                max_workers=CRAWL_WORKERS, folder_cache=None, on_error=None, cancel=None):
+    """Bring the stored documents of one root folder up to date.
+
+    The first sync of a root records a changes start-page token and then
+    crawls the whole tree. Later syncs read only the Drive changes feed since
+    the saved token and apply adds, renames, moves and trashes as upserts and
+    deletes through ``writer``; folders that newly appear in the tree are
+    crawled. Folders that fail to list are passed to ``on_error``; if any
+    did, or the ``cancel`` event was set during a crawl, the new token is not
+    saved so the next sync starts over. Returns a
+    dict with the number of files stored and removed and whether a full crawl
+    was done.
+    """
+    if folder_cache is None:
+        folder_cache = FolderCache()
+    service = worker_service(service_factory)
+    page_token, folders = _load_sync_state(db_path, root_id)
+    tree = _SyncedTree(root_id, folders, writer, db_path)
+    stats = {'stored': 0, 'removed': 0, 'full_crawl': page_token is None}
+
+    if page_token is None:
+        # Take the token first so changes made during the crawl are not missed
+        new_token = execute(service.changes().getStartPageToken())['startPageToken']
+        writer.execute("DELETE FROM synced_folders WHERE root_id = ?", (root_id,))
+        tree.add(root_id, None, folder_cache.get_name(service, root_id))
+        stats['stored'], failed = _crawl_into_tree(service_factory, tree, [root_id], writer, on_file, on_error,
+                                                   max_workers, folder_cache, cancel)
+    else:
+        changes, new_token = _fetch_changes(service, page_token)
+
+        def is_gone(change):
+            return change.get('removed') or change.get('file', {}).get('trashed')
+
+        folder_changes = [c for c in changes if not c.get('removed') and c['file']['mimeType'] == FOLDER_MIME]
+        file_changes = [c for c in changes if c.get('removed') or c['file']['mimeType'] != FOLDER_MIME]
+
+        # Folders: apply renames and moves in dependency order, since a folder's
+        # new parent may itself be new to the tree in this same batch
+        unresolved = []
+        for change in folder_changes:
+            if is_gone(change):
+                if change['fileId'] in tree:
+                    stats['removed'] += tree.remove(change['fileId'])
+            elif change['fileId'] == root_id:
+                # The root keeps its place whatever its own parent becomes
+                tree.add(root_id, None, change['file']['name'])
+                writer.execute("UPDATE documents SET folder = ? WHERE parent_id = ?", (change['file']['name'], root_id))
+            else:
+                unresolved.append(change['file'])
+
+        to_crawl = []
+        progress = True
+        while progress:
+            progress = False
+            for item in list(unresolved):
+                parent_id = (item.get('parents') or [None])[0]
+                if parent_id not in tree:
+                    continue
+                unresolved.remove(item)
+                progress = True
+                if item['id'] not in tree:
+                    to_crawl.append(item['id'])
+                elif tree.name(item['id']) != item['name']:
+                    writer.execute("UPDATE documents SET folder = ? WHERE parent_id = ?", (item['name'], item['id']))
+                tree.add(item['id'], parent_id, item['name'])
+                folder_cache.put(item['id'], item['name'])
+
+        # Whatever is left moved out of the tree
+        for item in unresolved:
+            if item['id'] in tree:
+                stats['removed'] += tree.remove(item['id'])
+        if root_id not in tree:
+            writer.execute("DELETE FROM sync_state WHERE root_id = ?", (root_id,))
+            return stats
+
+        # A new folder inside another new one is listed by the crawl of that one
+        to_crawl = [folder_id for folder_id in to_crawl
+                    if folder_id in tree and not tree.has_ancestor(folder_id, to_crawl)]
+        failed = 0
+        crawled = set()
+        if to_crawl:
+            stored, failed = _crawl_into_tree(service_factory, tree, to_crawl, writer, on_file, on_error,
+                                              max_workers, folder_cache, cancel)
+            stats['stored'] += stored
+            if failed:
+                # Forget the partial subtrees so they count as new when these changes are replayed
+                for folder_id in to_crawl:
+                    tree.remove(folder_id)
+            else:
+                crawled = set(tree.subtree(to_crawl))
+        # Files stored by _crawl_into_tree are counted by crawl_folders
+        crawled_files = stats['stored']
+
+        # Files: store those now inside the tree. The feed covers the whole drive,
+        # so of the rest only drop those stored under this tree; a file outside
+        # it may belong to another root
+        leaving = [change['fileId'] for change in file_changes
+                   if is_gone(change) or (change['file'].get('parents') or [None])[0] not in tree]
+        stored_parents = _stored_parents(db_path, leaving) if leaving else {}
+        for change in file_changes:
+            item = change.get('file')
+            parent_id = (item.get('parents') or [None])[0] if item else None
+            if is_gone(change) or parent_id not in tree:
+                if is_gone(change):
+                    # Gone from Drive altogether, whichever root stored it
+                    writer.delete(change['fileId'])
+                else:
+                    # Checked again by the writer, after any row another root's sync queued
+                    writer.execute("DELETE FROM documents WHERE drive_id = ? AND parent_id IN "
+                                   "(SELECT id FROM synced_folders WHERE root_id = ?)", (change['fileId'], root_id))
+                if stored_parents.get(change['fileId']) in tree:
+                    stats['removed'] += 1
+                continue
+            if parent_id in crawled:
+                # Already stored, as it is now, by the crawl of its new folder
+                continue
+            index = extract_index(item['name'])
+            item['docIndex'] = index if index is not None else "N/A"
+            item['folderName'] = tree.name(parent_id)
+            writer.write(item)
+            if on_file is not None:
+                on_file(item)
+            stats['stored'] += 1
+        metrics.count('items_total', stats['stored'] - crawled_files + stats['removed'], kind='file')
+
+    if failed:
+        # Keep the old state so the missed folders are picked up next time
+        if stats['full_crawl']:
+            writer.execute("DELETE FROM sync_state WHERE root_id = ?", (root_id,))
+        return stats
+    writer.execute("INSERT OR REPLACE INTO sync_state (root_id, page_token, synced_at) VALUES (?, ?, datetime('now'))",
+                   (root_id, new_token))
+    return stats
+
+def synced_roots(db_path=DB_PATH):
+    """Return the IDs of all root folders with a saved sync state."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT root_id FROM sync_state")]
+    finally:
+        conn.close()
+
+def sync(service_factory, folder_ids, writer, on_event=None, db_path=DB_PATH, max_workers=CRAWL_WORKERS,
+         folder_cache=None, cancel=None):
+    """Sync each root folder in turn, storing changes through ``writer``.
+
+    ``writer`` must be a DocumentWriter on ``db_path``, which also holds the
+    sync state. Emits ``file``, ``error`` and ``done`` events to ``on_event``
+    and returns the sync_folder stats keyed by root folder ID; a root whose
+    changes could not be read is reported as an error and left out. Setting
+    the ``cancel`` event cuts the current root short and skips the rest.
+    """
+    if folder_cache is None:
+        folder_cache = FolderCache()
+    results = {}
+    for root_id in folder_ids:
+        if cancel is not None and cancel.is_set():
+            break
+
+        def on_file(item, root_id=root_id):
+            emit(on_event, 'file', root_id=root_id, item=item)
+
+        def on_error(folder_id, error):
+            emit(on_event, 'error', folder_id=folder_id, error=error)
+
+        try:
+            results[root_id] = sync_folder(service_factory, root_id, writer, on_file, db_path, max_workers,
+                                           folder_cache, on_error, cancel)
+        except HttpError as error:
+            on_error(root_id, error)
+    emit(on_event, 'done', result=results)
+    return results
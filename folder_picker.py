@@ -0,0 +1,128 @@
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+# Height of one folder row in pixels
+ROW_HEIGHT = 22
+
+# Typing pause before the filter is applied, in milliseconds
+FILTER_DELAY_MS = 150
+
+class FolderPicker:
+    """Folder selection popup that stays responsive with tens of thousands of folders.
+
+    Only the rows in view exist, as canvas text items that are reused while
+    scrolling, and the search box filters through a FolderIndex once typing
+    pauses. With ``multiple`` any number of folders can be ticked, otherwise
+    a click picks one. ``on_select`` is called with the chosen folder dicts
+    when the Select button is pressed; with ``required`` an empty choice is
+    refused.
+    """
+
+    def __init__(self, parent, index, on_select, title="Select Folders", multiple=True, required=False):
+        self.index = index
+        self.on_select = on_select
+        self.multiple = multiple
+        self.required = required
+        self.matches = index.search("")
+        self.selected = set()
+        self.top = 0
+        self.rows = []
+        self._filter_job = None
+
+        self.popup = tk.Toplevel(parent)
+        self.popup.title(title)
+        self.popup.geometry("400x400")
+
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(self.popup, textvariable=self.search_var)
+        search_entry.pack(fill="x", padx=5, pady=5)
+        search_entry.bind("<KeyRelease>", self._schedule_filter)
+        search_entry.focus_set()
+
+        self.count_label = ttk.Label(self.popup, text="")
+        self.count_label.pack(anchor="w", padx=5)
+
+        select_button = ttk.Button(self.popup, text="Select", command=self._confirm)
+        select_button.pack(side="bottom", pady=10)
+
+        list_frame = ttk.Frame(self.popup)
+        list_frame.pack(fill="both", expand=True, padx=5, pady=5)
+        self.scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self._scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas = tk.Canvas(list_frame, highlightthickness=0)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.bind("<Configure>", lambda event: self._render())
+        self.canvas.bind("<Button-1>", self._click)
+        self.canvas.bind("<MouseWheel>", lambda event: self._scroll('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind("<Button-4>", lambda event: self._scroll('scroll', -1, 'units'))
+        self.canvas.bind("<Button-5>", lambda event: self._scroll('scroll', 1, 'units'))
+        self._render()
+
+    def _schedule_filter(self, event=None):
+        # Restart the delay on every key so only the last one filters
+        if self._filter_job is not None:
+            self.popup.after_cancel(self._filter_job)
+        self._filter_job = self.popup.after(FILTER_DELAY_MS, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        self.matches = self.index.search(self.search_var.get())
+        self.top = 0
+        self._render()
+
+    def _visible_rows(self):
+        return max(1, self.canvas.winfo_height() // ROW_HEIGHT)
+
+    def _render(self):
+        """Draw the rows in view, reusing the existing canvas items."""
+        visible = self._visible_rows()
+        self.top = max(0, min(self.top, len(self.matches) - visible))
+        while len(self.rows) < visible:
+            y = len(self.rows) * ROW_HEIGHT + ROW_HEIGHT // 2
+            self.rows.append(self.canvas.create_text(4, y, anchor="w", text=""))
+        for row, item in enumerate(self.rows):
+            n = self.top + row
+            text = ""
+            if row < visible and n < len(self.matches):
+                folder = self.index.folders[self.matches[n]]
+                ticked = folder['id'] in self.selected
+                if self.multiple:
+                    mark = "☑" if ticked else "☐"
+                else:
+                    mark = "◉" if ticked else "○"
+                text = f"{mark} {folder['name']}"
+            self.canvas.itemconfigure(item, text=text)
+
+        total = max(1, len(self.matches))
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + visible) / total))
+        self.count_label.configure(text=f"{len(self.matches)} of {len(self.index)} folders, "
+                                        f"{len(self.selected)} selected")
+
+    def _scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.top = int(float(amount) * len(self.matches))
+        else:
+            step = self._visible_rows() if unit == 'pages' else 1
+            self.top += int(amount) * step
+        self._render()
+
+    def _click(self, event):
+        n = self.top + int(event.y // ROW_HEIGHT)
+        if n >= len(self.matches):
+            return
+        folder_id = self.index.folders[self.matches[n]]['id']
+        if not self.multiple:
+            self.selected = {folder_id}
+        elif folder_id in self.selected:
+            self.selected.remove(folder_id)
+        else:
+            self.selected.add(folder_id)
+        self._render()
+
+    def _confirm(self):
+        chosen = [folder for folder in self.index.folders if folder['id'] in self.selected]
+        if self.required and not chosen:
+            messagebox.showerror("Error", "Please select a folder.", parent=self.popup)
+            return
+        self.popup.destroy()
+        self.on_select(chosen)
@@ -1,16 +1,17 @@
-import os
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import logging
 from ttkbootstrap import Style
+from drivecrawler.crawl import fetch_drive_folders
+from drivecrawler.folders import FolderIndex
+from drivecrawler.listing import FOLDER_LINK_FIELDS, FOLDER_MIME, FolderListings
+from drivecrawler.migrate import migrate
+from drivecrawler.service import FULL_SCOPES, service_pool, worker_service
+from folder_picker import FolderPicker
 
 # Define Google Drive API scope
-SCOPES = ['https://www.googleapis.com/auth/drive']
+SCOPES = FULL_SCOPES
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
@@ -19,188 +20,145 @@ logging.basicConfig(level=logging.DEBUG)
 selected_folders = []
 destination_folder_id = None
 
+# Cached listings and file counts of the selected folders, and the tree nodes not opened yet
+listings = FolderListings()
+unopened_nodes = {}
+
+# Walks older than this, in seconds, are listed again when a migration is planned
+LISTING_MAX_AGE = 10 * 60
+
+# Every Drive folder, fetched once per session for the folder pickers
+folder_index = None
+
 def authenticate():
-    """Authenticate with Google APIs."""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json')
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    """Return the shared Drive service pool, authenticating on first use only."""
+    return service_pool(SCOPES)
+
+def insert_folder_node(parent_node, folder_id, name, url):
+    """Insert a folder node with its cached file count; its children are rendered when it is opened."""
+    node = tree.insert(parent_node, 'end', text=f"{name} [{listings.file_count(folder_id)}]", values=("Folder", url))
+    if listings.cached_children(folder_id) != []:
+        # Placeholder so Tk draws the expand arrow
+        tree.insert(node, 'end', text="Loading...")
+        unopened_nodes[node] = folder_id
+    return node
+
+def open_folder_node(event):
+    """Render the children of a folder node the first time it is opened, from the cached listing."""
+    node = tree.focus()
+    folder_id = unopened_nodes.pop(node, None)
+    if folder_id is None:
+        return
+    tree.delete(*tree.get_children(node))
+    for item in listings.children(worker_service(authenticate()), folder_id):
+        if item['mimeType'] == FOLDER_MIME:
+            insert_folder_node(node, item['id'], item['name'], item['webViewLink'])
         else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return creds
-
-def explore_folder(service, folder_id, parent_node=None):
-    """ Recursively explore a folder and list files in all its subfolders. """
-    file_count = 0
-    page_token = None
-
-    while True:
-        # Use the page token to fetch the next page of files
-        query = f"'{folder_id}' in parents and trashed=false"
-        response = service.files().list(
-            q=query,
-            fields="nextPageToken, files(id, name, mimeType, webViewLink)",
-            pageToken=page_token
-        ).execute()
-
-        files = response.get('files', [])
-        if not files:
-            break
-
-        # Loop through the files/folders in the current folder
-        for item in files:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                # If the item is a folder, add it to the Treeview and explore it recursively
-                folder_node = tree.insert(parent_node, 'end', text=f"{item['name']} [0]", values=("Folder", item['webViewLink']))
-                folder_file_count = explore_folder(service, item['id'], folder_node)  # Recursive call for subfolders
-                # Update the folder node text with the actual file count after recursion
-                tree.item(folder_node, text=f"{item['name']} [{folder_file_count}]")
-                file_count += folder_file_count  # Add subfolder file count to total
-            else:
-                # If the item is a file, add it to the current folder's node
-                tree.insert(parent_node, 'end', text=item['name'], values=("File", item['webViewLink']))
-                file_count += 1
-
-        # Check for a next page of files
-        page_token = response.get('nextPageToken', None)
-        if not page_token:
-            break
-
-    return file_count
+            tree.insert(node, 'end', text=item['name'], values=("File", item['webViewLink']))
+
+def count_selected_folders(pool, folders, counting_node):
+    """Walk and count the selected folders off the UI thread, then show them."""
+    try:
+        listings.walk(worker_service(pool), [folder_id for _, folder_id, _ in folders])
+    except Exception as e:
+        logging.exception("Counting files failed")
+        # Bound now: ``e`` is unset once the except block ends, before the callback runs
+        message = f"Counting files failed: {e}"
+        tree.after(0, lambda: tree.item(counting_node, text=message))
+        return
+    tree.after(0, show_selected_folders, folders, counting_node)
+
+def show_selected_folders(folders, counting_node):
+    """Replace the counting placeholder with the selected folders and their file counts."""
+    tree.delete(counting_node)
+    total_cumulative_files = 0
+    for folder_name, folder_id, url in folders:
+        insert_folder_node("", folder_id, folder_name, url)
+        total_cumulative_files += listings.file_count(folder_id)
+
+    # Show the total cumulative file count across all selected folders
+    tree.insert("", "end", text="Total Cumulative Files", values=(total_cumulative_files, ""))
+
+def get_folder_index():
+    """Return the index of every Drive folder, fetching all pages on first use."""
+    global folder_index
+    if folder_index is None:
+        folder_index = FolderIndex(fetch_drive_folders(worker_service(authenticate()), FOLDER_LINK_FIELDS))
+    return folder_index
 
 def select_folders(tree):
     """Select folders from Google Drive."""
     global selected_folders
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
-    folders = service.files().list(
-        q="mimeType='application/vnd.google-apps.folder'",
-        fields="files(id, name, webViewLink)"
-    ).execute().get('files', [])
+    index = get_folder_index()
 
     selected_folders = []
-    if folders:
-        popup = tk.Toplevel()
-        popup.title("Select Folders")
-        popup.geometry("400x300")
-        popup.attributes('-topmost', True)
-
-        # Create a canvas with a scrollbar
-        canvas = tk.Canvas(popup)
-        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar = tk.Scrollbar(popup, orient=tk.VERTICAL, command=canvas.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        # Create a frame inside the canvas
-        frame = tk.Frame(canvas)
-        canvas.create_window((0, 0), window=frame, anchor=tk.NW)
-
-        def configure_scrollregion(event):
-            canvas.configure(scrollregion=canvas.bbox("all"))
-
-        frame.bind("<Configure>", configure_scrollregion)
-
-        checkbutton_value = {}
+    if len(index):
+        def get_selected_folders(folders):
+            for folder in folders:
+                selected_folders.append((folder['name'], folder['id'], folder['webViewLink']))
 
-        # Create checkbuttons for folders
-        for folder in folders:
-            var = tk.IntVar(value=0)
-            checkbutton = tk.Checkbutton(frame, text=folder['name'], variable=var)
-            checkbutton.pack(anchor=tk.W)
-            checkbutton_value[checkbutton] = (var, folder['id'], folder['webViewLink'])
+            if selected_folders:
+                counting_node = tree.insert("", "end", text="Counting files...", values=("", ""))
+                threading.Thread(target=count_selected_folders, args=(authenticate(), list(selected_folders),
+                                                                      counting_node), daemon=True).start()
 
-        def get_selected_folders():
-            global selected_folders
-            total_cumulative_files = 0
-
-            for checkbutton, (var, folder_id, url) in checkbutton_value.items():
-                if var.get() == 1:  # Check if the checkbutton is selected
-                    folder_name = checkbutton.cget("text")
-                    folder_node = tree.insert("", "end", text=f"Exploring folder: {folder_name}", values=("", ""))
-                    folder_file_count = explore_folder(service, folder_id, folder_node)  # Recursively explore
-                    total_cumulative_files += folder_file_count
-
-                    # Display cumulative files for the selected folder
-                    tree.insert(folder_node, "end", text=f"Total Files in {folder_name}", values=(folder_file_count, ""))
-
-            # Show the total cumulative file count across all selected folders
-            tree.insert("", "end", text="Total Cumulative Files", values=(total_cumulative_files, ""))
-
-            popup.destroy()
-
-        select_button = tk.Button(popup, text="Select", command=get_selected_folders)
-        select_button.pack(pady=10)
+        picker = FolderPicker(None, index, get_selected_folders)
+        picker.popup.attributes('-topmost', True)
 
 # Destination folder selection popup
 def select_destination_folder(destination_entry):
-    global destination_folder_id
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
-    folders = service.files().list(q="mimeType='application/vnd.google-apps.folder'",
-                                   fields="files(id, name, webViewLink)").execute().get('files', [])
+    index = get_folder_index()
 
-    if not folders:
+    if not len(index):
         messagebox.showerror("Error", "No folders found.")
         return
 
-    popup = tk.Toplevel()
-    popup.title("Select Destination Folder")
-    popup.geometry("400x300")
-
-    canvas = tk.Canvas(popup)
-    canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-    scrollbar = tk.Scrollbar(popup, orient=tk.VERTICAL, command=canvas.yview)
-    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-    canvas.configure(yscrollcommand=scrollbar.set)
-
-    frame = tk.Frame(canvas)
-    canvas.create_window((0, 0), window=frame, anchor=tk.NW)
-
-    radio_value = tk.StringVar()
-    for folder in folders:
-        radio = tk.Radiobutton(frame, text=folder['name'], variable=radio_value, value=folder['id'])
-        radio.pack(anchor=tk.W)
-
-    def get_selected_destination_folder():
+    def get_selected_destination_folder(folders):
         global destination_folder_id
-        destination_folder_id = radio_value.get()
-        if not destination_folder_id:
-            messagebox.showerror("Error", "Please select a destination folder.")
-            return
+        destination_folder_id = folders[0]['id']
         destination_entry.delete(0, tk.END)
         destination_entry.insert(0, destination_folder_id)
-        popup.destroy()
 
-    select_button = tk.Button(popup, text="Select", command=get_selected_destination_folder)
-    select_button.pack(pady=10)
+    FolderPicker(None, index, get_selected_destination_folder, "Select Destination Folder", multiple=False,
+                 required=True)
 
 # Migration logic
-def migrate_files(service, progress, progress_label):
-    total_files = 0
-    for folder_name, folder_id, _ in selected_folders:
-        page_token = None
-        while True:
-            response = service.files().list(q=f"'{folder_id}' in parents and trashed=false",
-                                            fields="nextPageToken, files(id, name)", pageToken=page_token).execute()
-            files = response.get('files', [])
-            if not files:
-                break
-            for file in files:
-                service.files().update(fileId=file['id'], addParents=destination_folder_id,
-                                       removeParents=folder_id, fields='id, parents').execute()
-                total_files += 1
-                progress['value'] += 1
-                progress_label.config(text=f"Migrating: {progress['value']} of {progress['maximum']}")
-                progress.update_idletasks()
-            page_token = response.get('nextPageToken', None)
-            if not page_token:
-                break
+def migrate_files(factory, progress, progress_label, resume=False):
+    progress_label.config(text="Resuming migration..." if resume else "Planning migration...")
+    failed = 0
+
+    def on_event(event):
+        nonlocal failed
+        if event['type'] == 'planned':
+            # Plan once: the manifest drives both the progress total and the moves
+            progress['maximum'] = event['total']
+            progress['value'] = 0
+        elif event['type'] == 'moved':
+            if event['error'] is not None:
+                failed += 1
+            progress['value'] += 1
+            status = f"Migrating: {progress['value']} of {progress['maximum']}"
+            if failed:
+                status += f" ({failed} failed)"
+            progress_label.config(text=status)
+            progress.update_idletasks()
+        elif event['type'] == 'done':
+            result = event['result']
+            progress_label.config(text=f"Migrated {result['total'] - result['failed']} of {result['total']} files"
+                                       + (f" ({result['failed']} failed)" if result['failed'] else ""))
+
+    folder_ids = [folder_id for _, folder_id, _ in selected_folders]
+    # Plan from the walk that counted the selected folders rather than listing them again
+    manifest = None if resume else listings.manifest(folder_ids, destination_folder_id, LISTING_MAX_AGE)
+    try:
+        migrate(factory, folder_ids, destination_folder_id, on_event, resume=resume, manifest=manifest)
+    except Exception as e:
+        # Only reached once the scheduler has given up retrying
+        logging.exception("Migration failed")
+        progress_label.config(text=f"Migration stopped: {e}")
+    finally:
+        # Files have moved, so the cached listings no longer hold
+        listings.clear()
 
 # Start migration in a thread
 def start_migration(progress, progress_label):
@@ -208,14 +166,15 @@ def start_migration(progress, progress_label):
         messagebox.showerror("Error", "Select folders and a destination folder.")
         return
 
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    # Batch workers each get their own connection, sharing the same credentials
+    factory = authenticate()
 
-    total_files = sum(explore_folder(service, folder_id) for _, folder_id, _ in selected_folders)
-    progress['maximum'] = total_files
-    progress['value'] = 0
+    threading.Thread(target=migrate_files, args=(factory, progress, progress_label)).start()
 
-    threading.Thread(target=migrate_files, args=(service, progress, progress_label)).start()
+# Finish the moves left in the saved manifest by an interrupted migration
+def resume_migration(progress, progress_label):
+    factory = authenticate()
+    threading.Thread(target=migrate_files, args=(factory, progress, progress_label, True)).start()
 
 # Main window setup
 def main():
@@ -250,6 +209,9 @@ def main():
     migrate_button = tk.Button(root, text="Start Migration", command=lambda: start_migration(progress, progress_label))
     migrate_button.pack(pady=10)
 
+    resume_button = tk.Button(root, text="Resume Migration", command=lambda: resume_migration(progress, progress_label))
+    resume_button.pack()
+
     tree_frame = tk.Frame(root)
     tree_frame.pack(fill=tk.BOTH, expand=True)
 
@@ -262,6 +224,7 @@ def main():
     tree.heading("Type", text="Type")
     tree.heading("Files", text="Files")
     tree_scrollbar.config(command=tree.yview)
+    tree.bind("<<TreeviewOpen>>", open_folder_node)
     tree.pack(fill=tk.BOTH, expand=True)
 
     root.mainloop()
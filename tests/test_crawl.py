@@ -0,0 +1,100 @@
+"""Resuming checkpointed crawls against the simulated Drive."""
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from drivecrawler import scheduler
+from drivecrawler.crawl import CrawlCheckpoint, crawl
+from drivecrawler.db import DocumentWriter, init_db
+from drivecrawler.simulator import ROOT_ID, SimulatedDrive
+
+class RecordingDrive(SimulatedDrive):
+    """SimulatedDrive that records the query and page token of every listing."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listings = []
+        self.issued = set()
+
+    def _list(self, query, fields, page_size, page_token):
+        self.listings.append((query, page_token))
+        response = super()._list(query, fields, page_size, page_token)
+        if 'nextPageToken' in response:
+            self.issued.add((query, response['nextPageToken']))
+        return response
+
+class CrawlResumeTest(unittest.TestCase):
+    def setUp(self):
+        scheduler.configure(rate=100000, burst=100000)
+        self.workdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.workdir.name, 'documents.db')
+        init_db(self.db_path)
+        # Two roots whose subfolders are listed together, several pages at a time
+        self.drive = RecordingDrive(depth=0, files=0)
+        self.roots = [self.drive.add_folder(ROOT_ID, name, log=False) for name in ("A", "B")]
+        self.files = 0
+        for root_id in self.roots:
+            for _ in range(3):
+                folder_id = self.drive.add_folder(root_id, log=False)
+                for _ in range(400):
+                    self.drive.add_file(folder_id, log=False)
+                self.files += 400
+        self.crawl(self.roots, cancel_after=1)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def crawl(self, roots, resume=False, cancel_after=None):
+        """Crawl ``roots`` one listing at a time, cancelling once ``cancel_after`` pages have files."""
+        cancel = threading.Event()
+        pages = []
+
+        def on_event(event):
+            if event['type'] == 'file' and cancel_after is not None:
+                page = len(self.drive.listings)
+                if page not in pages:
+                    pages.append(page)
+                if len(pages) >= cancel_after:
+                    cancel.set()
+
+        with DocumentWriter(self.db_path) as writer:
+            checkpoint = CrawlCheckpoint(writer, self.db_path, resume=resume)
+            return crawl(lambda: self.drive, roots, writer, on_event, max_workers=1, cancel=cancel,
+                         checkpoint=checkpoint)
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        finally:
+            conn.close()
+
+    def resume(self, roots):
+        """Resume a crawl of ``roots``; return its counts and the saved (query, page token) it continued."""
+        saved = set(self.drive.issued)
+        self.drive.listings.clear()
+        counts = self.crawl(roots, resume=True)
+        for query, page_token in self.drive.listings:
+            if page_token:
+                # Every page token went back with the query it was issued for
+                self.assertIn((query, page_token), self.drive.issued)
+        return counts, [listing for listing in self.drive.listings if listing in saved]
+
+    def test_resumed_query_matches_the_original(self):
+        # Roots given in another order read their saved rows back in another order
+        counts, continued = self.resume(self.roots[::-1])
+        self.assertEqual(len(continued), 1)
+        self.assertEqual(self.stored(), self.files)
+        self.assertEqual(sum(counts.values()), self.files - 1000)
+
+    def test_group_split_across_roots_starts_over(self):
+        for roots in (self.roots[:1], self.roots[1:]):
+            with self.subTest(roots=roots):
+                _, continued = self.resume(roots)
+                self.assertEqual(continued, [])
+        self.assertEqual(self.stored(), self.files)
+
+if __name__ == '__main__':
+    unittest.main()
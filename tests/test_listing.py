@@ -0,0 +1,47 @@
+"""Migration manifests planned from cached folder walks."""
+import unittest
+
+from drivecrawler import scheduler
+from drivecrawler.listing import FolderListings
+from drivecrawler.migrate import plan_migration
+from drivecrawler.simulator import ROOT_ID, SimulatedDrive
+
+class FolderListingsManifestTest(unittest.TestCase):
+    def setUp(self):
+        scheduler.configure(rate=100000, burst=100000)
+        self.drive = SimulatedDrive(depth=2, fanout=3, files=4)
+        self.selected = self.drive.ids(folders=True)[:2]
+        self.destination = self.drive.add_folder(ROOT_ID, "Destination")
+        self.listings = FolderListings()
+
+    def test_manifest_matches_plan_without_listing_again(self):
+        self.listings.walk(self.drive, self.selected)
+        listed = self.drive.calls['files.list']
+        manifest = self.listings.manifest(self.selected, self.destination)
+        self.assertEqual(self.drive.calls['files.list'], listed)
+        self.assertEqual(sorted(manifest), sorted(plan_migration(self.drive, self.selected, self.destination)))
+
+    def test_unwalked_or_stale_folders_need_planning(self):
+        self.assertIsNone(self.listings.manifest(self.selected, self.destination))
+        self.listings.children(self.drive, self.selected[0])
+        self.assertIsNone(self.listings.manifest(self.selected[:1], self.destination))
+        self.listings.walk(self.drive, self.selected)
+        self.assertIsNotNone(self.listings.manifest(self.selected, self.destination, max_age=60))
+        self.assertIsNone(self.listings.manifest(self.selected, self.destination, max_age=-1))
+        self.listings.clear()
+        self.assertIsNone(self.listings.manifest(self.selected, self.destination))
+
+    def test_clear_during_walk(self):
+        # A migration finishing on another thread while the walk is listing
+        list_files = self.drive._list
+
+        def list_and_clear(*args):
+            self.listings.clear()
+            return list_files(*args)
+        self.drive._list = list_and_clear
+        self.listings.walk(self.drive, self.selected)
+        self.assertIsNotNone(self.listings.file_count(self.selected[0]))
+        self.assertIsNone(self.listings.manifest(self.selected, self.destination))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Keyset paging of documents with legacy NULL sort keys."""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from drivecrawler.db import init_db
+from drivecrawler.query import DocumentPager
+
+class DocumentPagerTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.workdir.name, 'documents.db')
+        # A database from before the schema was versioned, with an unparsed index
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "name TEXT, doc_index TEXT, folder TEXT, url TEXT)")
+        conn.executemany("INSERT INTO documents (name, doc_index, folder, url) VALUES (?, ?, ?, ?)", [
+            ("CKS 1-27072023.pdf", "1", "MP2", "https://drive.google.com/file/d/a/view"),
+            ("scan.pdf", None, "MP2", "https://drive.google.com/file/d/b/view"),
+            ("CKS 2-27072023.pdf", "2", None, "https://drive.google.com/file/d/c/view"),
+        ])
+        conn.commit()
+        conn.close()
+        init_db(self.db_path)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def pages(self, sort, descending):
+        pager = DocumentPager(self.db_path, page_size=1)
+        try:
+            rows = pager.set_query(sort, descending)
+            while True:
+                page = pager.next_page()
+                if not page:
+                    return rows
+                rows += page
+        finally:
+            pager.close()
+
+    def test_every_row_is_reached_in_both_directions(self):
+        for sort in ('name', 'doc_index', 'folder'):
+            for descending in (False, True):
+                with self.subTest(sort=sort, descending=descending):
+                    self.assertEqual(len(self.pages(sort, descending)), 3)
+
+    def test_previous_page_after_rows_were_deleted(self):
+        pager = DocumentPager(self.db_path, page_size=1)
+        try:
+            pager.next_page()
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("DELETE FROM documents WHERE name = 'CKS 1-27072023.pdf'")
+            conn.commit()
+            conn.close()
+            self.assertEqual(pager.previous_page(), [])
+        finally:
+            pager.close()
+
+    def test_prefix_search_ignores_case(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO documents (name, doc_index, folder, url, drive_id) VALUES (?, ?, ?, ?, ?)",
+                     ("Zebra.pdf", "N/A", "Zoo", "https://drive.google.com/file/d/z/view", "z"))
+        conn.commit()
+        conn.close()
+        pager = DocumentPager(self.db_path)
+        try:
+            for search in ('z', 'Z', 'ZEB', 'zoo'):
+                with self.subTest(search=search):
+                    self.assertEqual([row[0] for row in pager.set_query(search=search)], ["Zebra.pdf"])
+        finally:
+            pager.close()
+
+if __name__ == '__main__':
+    unittest.main()
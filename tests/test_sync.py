@@ -0,0 +1,106 @@
+"""Incremental sync of several roots against the simulated Drive."""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from drivecrawler import scheduler
+from drivecrawler.db import DocumentWriter, init_db
+from drivecrawler.simulator import ROOT_ID, SimulatedDrive
+from drivecrawler.sync import sync
+
+class MultiRootSyncTest(unittest.TestCase):
+    def setUp(self):
+        scheduler.configure(rate=100000, burst=100000)
+        self.workdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.workdir.name, 'documents.db')
+        init_db(self.db_path)
+        # Two sibling roots of three files each, plus an unsynced folder
+        self.drive = SimulatedDrive(depth=0, files=0)
+        self.root_a = self.drive.add_folder(ROOT_ID, "A", log=False)
+        self.root_b = self.drive.add_folder(ROOT_ID, "B", log=False)
+        self.other = self.drive.add_folder(ROOT_ID, "Other", log=False)
+        self.files_a = [self.drive.add_file(self.root_a, log=False) for _ in range(3)]
+        self.files_b = [self.drive.add_file(self.root_b, log=False) for _ in range(3)]
+        self.sync([self.root_a, self.root_b])
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def sync(self, roots):
+        with DocumentWriter(self.db_path) as writer:
+            return sync(lambda: self.drive, roots, writer, db_path=self.db_path, max_workers=2)
+
+    def parent_of(self, file_id):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT parent_id FROM documents WHERE drive_id = ?", (file_id,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def test_new_file_survives_sync_of_other_root(self):
+        file_id = self.drive.add_file(self.root_b)
+        results = self.sync([self.root_b, self.root_a])
+        self.assertEqual(self.parent_of(file_id), self.root_b)
+        self.assertEqual(results[self.root_b]['stored'], 1)
+        self.assertEqual(results[self.root_a]['removed'], 0)
+
+    def test_file_moved_between_roots(self):
+        file_id = self.files_a[0]
+        self.drive.files().update(fileId=file_id, addParents=self.root_b, removeParents=self.root_a).execute()
+        for roots in ([self.root_b, self.root_a], [self.root_a, self.root_b]):
+            with self.subTest(roots=roots):
+                self.drive.rename(file_id, f"CKS {len(roots[0])}-01012025.pdf")
+                self.sync(roots)
+                self.assertEqual(self.parent_of(file_id), self.root_b)
+
+    def test_file_moved_out_of_synced_roots(self):
+        file_id = self.files_a[1]
+        self.drive.files().update(fileId=file_id, addParents=self.other, removeParents=self.root_a).execute()
+        results = self.sync([self.root_b, self.root_a])
+        self.assertIsNone(self.parent_of(file_id))
+        self.assertEqual(results[self.root_a]['removed'], 1)
+        self.assertEqual(results[self.root_b]['removed'], 0)
+
+    def test_trashed_file_is_removed_once(self):
+        self.drive.trash(self.files_b[0])
+        results = self.sync([self.root_a, self.root_b])
+        self.assertIsNone(self.parent_of(self.files_b[0]))
+        self.assertEqual(results[self.root_a]['removed'], 0)
+        self.assertEqual(results[self.root_b]['removed'], 1)
+
+    def test_new_nested_folders_are_stored_once(self):
+        folder_id = self.drive.add_folder(self.root_a)
+        subfolder_id = self.drive.add_folder(folder_id)
+        file_ids = [self.drive.add_file(subfolder_id) for _ in range(2)]
+        listed = self.drive.calls['files.list']
+        results = self.sync([self.root_a])
+        self.assertEqual(results[self.root_a]['stored'], 2)
+        # The new folder, then its subfolder
+        self.assertEqual(self.drive.calls['files.list'] - listed, 2)
+        for file_id in file_ids:
+            self.assertEqual(self.parent_of(file_id), subfolder_id)
+
+    def test_removed_folders_count_their_files(self):
+        folder_id = self.drive.add_folder(self.root_a)
+        for _ in range(4):
+            self.drive.add_file(folder_id)
+        trashed_id = self.drive.add_folder(self.root_b)
+        for _ in range(2):
+            self.drive.add_file(trashed_id)
+        self.sync([self.root_a, self.root_b])
+        self.drive.files().update(fileId=folder_id, addParents=self.other, removeParents=self.root_a).execute()
+        self.drive.trash(trashed_id)
+        results = self.sync([self.root_a, self.root_b])
+        self.assertEqual(results[self.root_a]['removed'], 4)
+        self.assertEqual(results[self.root_b]['removed'], 2)
+
+    def test_changes_outside_synced_roots_are_ignored(self):
+        self.drive.add_file(self.other)
+        results = self.sync([self.root_a, self.root_b])
+        for root_id in (self.root_a, self.root_b):
+            self.assertEqual(results[root_id], {'stored': 0, 'removed': 0, 'full_crawl': False})
+
+if __name__ == '__main__':
+    unittest.main()